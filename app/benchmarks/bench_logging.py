@@ -0,0 +1,152 @@
+"""
+Measures the logging overhead of one /segment_predictor request, before and
+after the queue-based pipeline of utils.logger_config.
+
+Every setup replays the same log calls at the same levels: a request summary,
+one INFO line per point and the access log. Only the pipeline differs. The
+"legacy" setup is the former configuration, basicConfig with a synchronous
+stream handler. The "queued" setup is the current one: the request thread
+only enqueues unformatted records and a listener thread formats them as JSON
+and writes them. "queued" disables the per-call-site rate limit, and "sampled"
+uses LOG_RATE_LIMIT. Requests are replayed from a thread pool, like the
+admission executor, and the time spent inside logging calls is reported per
+request. The listener drain time is reported separately since it is off the
+request path, as are the records dropped because the queue was full; raise
+LOG_QUEUE_SIZE to compare without drops.
+
+Usage (from the app directory):
+
+    python -m benchmarks.bench_logging --requests 2000 --threads 8 --points 50
+"""
+
+import os
+import time
+import atexit
+import random
+import logging
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from schemas.segment import SegmentRequestBase
+from utils import logger_config
+
+
+def predictor_request(n_points: int, seed: int = 0) -> SegmentRequestBase:
+    rng = random.Random(seed)
+    return SegmentRequestBase(
+        project="bologna",
+        id="aoi1",
+        bbox=[11.33, 44.49, 11.34, 44.50],
+        zoom=18,
+        action_type="multi_point",
+        point_coords=[(rng.uniform(11.33, 11.34), rng.uniform(44.49, 44.50)) for _ in range(n_points)],
+        point_labels=[1] * n_points,
+    )
+
+
+def request_calls(request):
+    """The log calls of one predictor request, identical in every setup."""
+    log = logger_config.log
+    project, id = request.project, request.id
+    log.info(
+        "Predictor request for %s/%s: %s with %d points",
+        project,
+        id,
+        request.action_type,
+        len(request.point_coords or []),
+    )
+    log.info("Image features for %s/%s: %s", project, id, "memory")
+    for index, p_coords in enumerate(request.point_coords):
+        log.info(
+            "Processing multi-point %s for id: %s, project: %s, point index: %d", p_coords, id, project, index
+        )
+    log.info("Simplifying geometries with tolerance %s.", 0.000001)
+    log.info("Filtering geometries with area greater than %s m².", 5)
+    logger_config.access_log.info(
+        "%s %s %d in %.3fs",
+        "POST",
+        "/segment_predictor",
+        200,
+        0.123,
+        extra={"method": "POST", "path": "/segment_predictor", "status": 200, "duration": 0.123},
+    )
+
+
+def legacy_setup(stream):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        stream=stream,
+        force=True,
+    )
+    return None, None
+
+
+def queued_setup(rate_limit):
+    def setup(stream):
+        handler, listener = logger_config.configure_logging(stream)
+        for log_filter in handler.filters:
+            if isinstance(log_filter, logger_config.RateLimitFilter):
+                log_filter.rate = rate_limit
+        return handler, listener
+
+    return setup
+
+
+def replay(name, setup, request, n_requests, n_threads, stream):
+    handler, listener = setup(stream)
+
+    def one(index):
+        token = logger_config.request_id.set(f"req-{index}")
+        start = time.perf_counter()
+        request_calls(request)
+        elapsed = time.perf_counter() - start
+        logger_config.request_id.reset(token)
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_threads) as executor:
+        per_request = sorted(executor.map(one, range(n_requests)))
+    wall = time.perf_counter() - start
+    drain_start = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+        atexit.unregister(listener.stop)
+    drain = time.perf_counter() - drain_start
+    stream.flush()
+
+    def pct(q):
+        return per_request[min(len(per_request) - 1, int(q * len(per_request)))] * 1e6
+
+    print(
+        f"{name:>8} {statistics.mean(per_request) * 1e6:>9.1f} {pct(0.5):>9.1f} {pct(0.99):>9.1f} "
+        f"{wall * 1000:>8.0f} {drain * 1000:>9.0f} {handler.dropped if handler else 0:>8}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--points", type=int, default=50, help="Points per request")
+    parser.add_argument("--output", default=os.devnull, help="File the records are written to")
+    args = parser.parse_args()
+
+    request = predictor_request(args.points)
+    print(f"{args.requests} requests with {args.points} points on {args.threads} threads")
+    print(f"{'setup':>8} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'wall ms':>8} {'drain ms':>9} {'dropped':>8}")
+    # Line buffered, like stderr
+    with open(args.output, "w", buffering=1) as stream:
+        runs = [
+            ("legacy", legacy_setup),
+            ("queued", queued_setup(0)),
+            ("sampled", queued_setup(logger_config.LOG_RATE_LIMIT)),
+        ]
+        for name, setup in runs:
+            replay(name, setup, request, args.requests, args.threads, stream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmarks the mask cleanup stage on dense automatic-mode label rasters.
+
+Synthetic masks mimic SAM2 automatic output: a few hundred irregular objects
+with jagged edges, pinholes and speckles. For each raster size, the raw path
+(vectorize, then simplify/area filter and encode) is compared with the cleaned
+path (cleanup first), reporting feature counts and time per stage. A real
+label mask GeoTIFF written by the automatic generator can be used instead
+with --mask.
+
+Usage (from the app directory):
+
+    python -m benchmarks.bench_mask_cleanup --sizes 1024 2048
+"""
+
+import time
+import argparse
+import numpy as np
+import rasterio
+from rasterio.transform import from_bounds
+from scipy import ndimage
+
+from schemas.segment import MaskCleanupOptions
+from utils.convert import vectorize_mask, read_simplify_and_filter_by_area
+from utils.mask_cleanup import clean_label_mask
+from utils.responses import dumps
+
+
+def synthetic_label_mask(size: int, n_objects: int = 250, seed: int = 0) -> np.ndarray:
+    """Builds a label raster with noisy objects, like unprocessed automatic masks."""
+    rng = np.random.default_rng(seed)
+    labels = np.zeros((size, size), dtype=np.uint8)
+    y, x = np.ogrid[:size, :size]
+    scale = size / 1024
+    for value in range(1, n_objects + 1):
+        row, col = rng.integers(0, size, 2)
+        a, b = rng.uniform(6, 40, 2) * scale
+        angle = rng.uniform(0, np.pi)
+        dy, dx = y - row, x - col
+        u = dx * np.cos(angle) + dy * np.sin(angle)
+        v = -dx * np.sin(angle) + dy * np.cos(angle)
+        labels[(u / a) ** 2 + (v / b) ** 2 <= 1] = value
+
+    # Jagged edges: flip pixels along object boundaries
+    edges = ndimage.morphological_gradient(labels, size=3) != 0
+    flip = edges & (rng.random(labels.shape) < 0.3)
+    labels[flip] = ndimage.maximum_filter(labels, size=3)[flip] * (rng.random(flip.sum()) < 0.5)
+    # Pinholes inside objects and speckles near them
+    labels[(labels != 0) & (rng.random(labels.shape) < 0.01)] = 0
+    near = ndimage.maximum_filter(labels, size=9)
+    speckles = (labels == 0) & (near != 0) & (rng.random(labels.shape) < 0.01)
+    labels[speckles] = near[speckles]
+    return labels
+
+
+def run(labels, transform, crs, cleanup):
+    timings = {}
+    start = time.perf_counter()
+    if cleanup:
+        labels = clean_label_mask(labels, **cleanup)
+    timings["cleanup"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gdf = vectorize_mask(labels, transform, crs)
+    timings["vectorize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    geojson = read_simplify_and_filter_by_area(None, None, 0, 0, None, gdf=gdf)
+    body = dumps(geojson)
+    timings["postprocess"] = time.perf_counter() - start
+    timings["total"] = sum(timings.values())
+    return len(gdf), len(body), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024, 2048])
+    parser.add_argument("--mask", default=None, help="Label mask GeoTIFF to use instead of synthetic data")
+    parser.add_argument("--smooth-sigma", type=float, default=0.0)
+    args = parser.parse_args()
+
+    cleanup = MaskCleanupOptions(smooth_sigma=args.smooth_sigma).model_dump()
+    print(f"Cleanup settings: {cleanup}")
+
+    if args.mask:
+        with rasterio.open(args.mask) as src:
+            cases = [(args.mask, src.read(1), src.transform, src.crs)]
+    else:
+        cases = []
+        for size in args.sizes:
+            transform = from_bounds(11.33, 44.49, 11.34, 44.50, size, size)
+            cases.append((f"{size}x{size}", synthetic_label_mask(size), transform, "EPSG:4326"))
+
+    print(
+        f"{'raster':>12} {'path':>8} {'features':>9} {'MB':>6} {'cleanup ms':>11} "
+        f"{'vectorize ms':>13} {'post ms':>8} {'total ms':>9}"
+    )
+    for name, labels, transform, crs in cases:
+        for path, options in (("raw", None), ("cleaned", cleanup)):
+            n_features, n_bytes, t = run(labels, transform, crs, options)
+            print(
+                f"{name:>12} {path:>8} {n_features:>9} {n_bytes / 1e6:>6.1f} "
+                f"{t['cleanup'] * 1000:>11.0f} {t['vectorize'] * 1000:>13.0f} "
+                f"{t['postprocess'] * 1000:>8.0f} {t['total'] * 1000:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
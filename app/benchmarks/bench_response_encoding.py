@@ -0,0 +1,101 @@
+"""
+Benchmarks response encoding for large /segment_automatic FeatureCollections.
+
+Compares the previous path (SegmentResponseBase validation, jsonable_encoder and
+JSONResponse) with the fast path in utils.responses (direct byte serialization,
+optionally compressed). Synthetic features mimic automatic-mode output: polygons
+with tens of vertices and the "value" / "area_m2" properties.
+
+Usage (from the app directory):
+
+    python -m benchmarks.bench_response_encoding --features 1000 10000 30000
+"""
+
+import math
+import time
+import random
+import argparse
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from schemas.segment import SegmentResponseBase
+from utils.responses import encode_response_body
+
+
+def synthetic_feature_collection(n_features: int, vertices: int = 40, seed: int = 0) -> dict:
+    """Builds a FeatureCollection shaped like the output of `to_geo_dict`."""
+    rng = random.Random(seed)
+    features = []
+    for index in range(n_features):
+        lon, lat = 11.37 + rng.random() * 0.02, 44.51 + rng.random() * 0.02
+        radius = 0.00005 + rng.random() * 0.0002
+        ring = tuple(
+            (
+                lon + radius * math.cos(2 * math.pi * k / vertices) * (0.8 + 0.4 * rng.random()),
+                lat + radius * math.sin(2 * math.pi * k / vertices) * (0.8 + 0.4 * rng.random()),
+            )
+            for k in range(vertices)
+        )
+        features.append(
+            {
+                "id": str(index),
+                "type": "Feature",
+                "properties": {
+                    "value": np.float64(index + 1),
+                    "area_m2": np.float64(rng.random() * 500),
+                },
+                "geometry": {"type": "Polygon", "coordinates": (ring + ring[:1],)},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def previous_path(data: dict) -> bytes:
+    # The numpy scalars were plain floats after json.loads(gdf.to_json())
+    data = {
+        **data,
+        "features": [
+            {**f, "properties": {k: float(v) for k, v in f["properties"].items()}}
+            for f in data["features"]
+        ],
+    }
+    return JSONResponse(content=jsonable_encoder(SegmentResponseBase(**data))).body
+
+
+def best_of(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--features", type=int, nargs="+", default=[1000, 10000, 30000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'features':>9} {'path':>14} {'time (ms)':>10} {'size (KB)':>10}")
+    for n_features in args.features:
+        data = synthetic_feature_collection(n_features)
+        paths = {
+            "previous": lambda: (previous_path(data), None),
+            "fast": lambda: encode_response_body(data),
+            "fast+gzip": lambda: encode_response_body(data, "gzip"),
+            "fast+br": lambda: encode_response_body(data, "br"),
+        }
+        for name, fn in paths.items():
+            body, encoding = fn()
+            if name.endswith("br") and encoding != "br":
+                continue  # brotli not installed
+            seconds = best_of(fn, args.repeats)
+            print(f"{n_features:>9} {name:>14} {seconds * 1000:>10.1f} {len(body) / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
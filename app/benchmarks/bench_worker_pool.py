@@ -0,0 +1,121 @@
+"""
+Measures how /segment_predictor throughput scales with the number of inference
+worker processes (utils.worker_pool).
+
+For each worker count the pool is started, every worker is warmed up (model
+load and image features), and then a fixed number of single-point requests,
+spread over the given AOIs with random clicks, is sent from a thread pool.
+Run it on the target machine; the AOIs must have been fetched with /aoi first.
+
+Usage (from the app directory):
+
+    python -m benchmarks.bench_worker_pool --project bologna --ids aoi1 aoi2 aoi3 aoi4 \\
+        --workers 1 2 4 --requests 64
+"""
+
+import os
+import time
+import random
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import rasterio
+from rasterio.warp import transform_bounds
+
+from schemas.segment import SegmentRequestBase
+from utils.worker_pool import InferencePool
+
+
+def aoi_requests(project, ids, n_requests, model_id=None, seed=0):
+    """Builds single-point predictor requests with clicks inside each AOI."""
+    rng = random.Random(seed)
+    bounds = {}
+    for id in ids:
+        with rasterio.open(os.path.join("public", project, f"{id}.tif")) as src:
+            bounds[id] = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+
+    requests = []
+    for index in range(n_requests):
+        id = ids[index % len(ids)]
+        min_lon, min_lat, max_lon, max_lat = bounds[id]
+        point = (rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat))
+        requests.append(
+            SegmentRequestBase(
+                project=project,
+                id=id,
+                bbox=list(bounds[id]),
+                zoom=18,
+                action_type="single_point",
+                point_coords=[point],
+                point_labels=[1],
+                model_id=model_id,
+            )
+        )
+    return requests
+
+
+def run_pool(n_workers, requests, concurrency, ids):
+    pool = InferencePool(n_workers)
+    pool.start()
+    try:
+        # One request per AOI loads the model and computes the image features in its worker
+        for request in requests[: len(ids)]:
+            result = pool.run("predictor", request)
+            if isinstance(result, dict):
+                raise RuntimeError(f"Warm-up failed: {result['error']}")
+
+        latencies, errors = [], 0
+
+        def timed(request):
+            start = time.perf_counter()
+            result = pool.run("predictor", request)
+            return time.perf_counter() - start, isinstance(result, dict)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for elapsed, failed in executor.map(timed, requests):
+                latencies.append(elapsed)
+                errors += failed
+        wall = time.perf_counter() - start
+        return {
+            "workers": pool.n_workers,
+            "cores": len(pool.cores[0]),
+            "throughput": len(requests) / wall,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000,
+            "errors": errors,
+            "per_worker": pool.stats["submitted"],
+        }
+    finally:
+        pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--ids", nargs="+", required=True, help="AOI IDs already fetched with /aoi")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=None, help="Default: 2 x max workers")
+    parser.add_argument("--model", default=None, help="SAM2 model ID, e.g. sam2-hiera-small")
+    args = parser.parse_args()
+
+    requests = aoi_requests(args.project, args.ids, args.requests, args.model)
+    concurrency = args.concurrency or 2 * max(args.workers)
+
+    print(f"{os.cpu_count()} CPUs, {args.requests} requests over {len(args.ids)} AOIs, concurrency {concurrency}")
+    print(f"{'workers':>8} {'cores/w':>8} {'req/s':>8} {'speedup':>8} {'eff.':>6} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}  per worker")
+    baseline = None
+    for n_workers in args.workers:
+        row = run_pool(n_workers, requests, concurrency, args.ids)
+        baseline = baseline or row["throughput"]
+        speedup = row["throughput"] / baseline
+        print(
+            f"{row['workers']:>8} {row['cores']:>8} {row['throughput']:>8.2f} {speedup:>7.2f}x "
+            f"{speedup / row['workers']:>6.0%} {row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} "
+            f"{row['errors']:>7}  {row['per_worker']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
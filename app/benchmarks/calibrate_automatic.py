@@ -0,0 +1,122 @@
+"""
+Calibrates the /segment_automatic cost model on the current hardware.
+
+Each quality tier is run on an AOI raster resampled to several sizes, and a linear
+model (intercept + seconds per megapixel) is fitted per tier. The coefficients are
+written under the current device type in the calibration file used by the service.
+
+Usage (from the app directory):
+
+    python -m benchmarks.calibrate_automatic --image public/<project>/<id>.tif
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from utils.automatic_profiles import AUTOMATIC_PROFILES, CALIBRATION_FILE, device_type
+from utils.model_registry import DEFAULT_AUTOMATIC_MODEL, SAM2_MODELS
+from utils.sam2 import device, get_mask_generator, models
+
+
+def resample_raster(src_path: str, dst_path: str, side: int):
+    """Writes a copy of `src_path` resampled so that its longest side is `side` pixels."""
+    with rasterio.open(src_path) as src:
+        scale = side / max(src.width, src.height)
+        width, height = max(int(src.width * scale), 1), max(int(src.height * scale), 1)
+        data = src.read(out_shape=(src.count, height, width), resampling=Resampling.bilinear)
+        transform = src.transform * src.transform.scale(src.width / width, src.height / height)
+        profile = src.profile
+        profile.update(width=width, height=height, transform=transform)
+    with rasterio.open(dst_path, "w", **profile) as dst:
+        dst.write(data)
+    return width * height / 1e6
+
+
+def time_tier(model_id: str, quality: str, tif_path: str, repeats: int) -> float:
+    """Returns the median generate time in seconds of a model and quality tier."""
+    times = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mask_path = os.path.join(tmp_dir, "mask.tif")
+        with models.use(model_id, automatic=True) as entry:
+            sam2 = entry.model
+            sam2.mask_generator = get_mask_generator(entry, quality)
+            for _ in range(repeats):
+                start = time.monotonic()
+                sam2.generate(tif_path, output=mask_path)
+                times.append(time.monotonic() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--image", required=True, help="Representative AOI GeoTIFF")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[256, 512, 1024, 2048],
+        help="Longest image side in pixels to benchmark",
+    )
+    parser.add_argument(
+        "--model",
+        default=DEFAULT_AUTOMATIC_MODEL,
+        choices=list(SAM2_MODELS),
+        help="SAM2 model to calibrate. The default model also sets the device-wide fallback.",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default=CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    device_kind = device_type(device)
+    coefficients = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rasters = []
+        for side in args.sizes:
+            path = os.path.join(tmp_dir, f"aoi_{side}.tif")
+            rasters.append((resample_raster(args.image, path, side), path))
+
+        for quality in AUTOMATIC_PROFILES:
+            # Warm-up run so model loading and kernel compilation are not measured
+            time_tier(args.model, quality, rasters[0][1], 1)
+            samples = [
+                (mpx, time_tier(args.model, quality, path, args.repeats)) for mpx, path in rasters
+            ]
+            for mpx, seconds in samples:
+                print(
+                    f"{device_kind:>5} {args.model:>20} {quality:>9} "
+                    f"{mpx:8.3f} MP {seconds:8.3f} s"
+                )
+            x = np.array([mpx for mpx, _ in samples])
+            y = np.array([seconds for _, seconds in samples])
+            slope, intercept = np.polyfit(x, y, 1)
+            coefficients[quality] = {
+                "intercept_s": round(max(float(intercept), 0.0), 4),
+                "s_per_mpx": round(max(float(slope), 0.0), 4),
+            }
+
+    calibration = {"devices": {}}
+    if os.path.exists(args.output):
+        with open(args.output, "r") as calibration_file:
+            calibration = json.load(calibration_file)
+    calibration.pop("note", None)
+    calibration["source"] = "benchmarks/calibrate_automatic.py"
+    # Only what was measured here is marked calibrated; other devices keep their estimates
+    device_calibration = calibration["devices"].setdefault(device_kind, {})
+    device_calibration.setdefault("models", {})[args.model] = {**coefficients, "calibrated": True}
+    if args.model == DEFAULT_AUTOMATIC_MODEL:
+        device_calibration.update(coefficients, calibrated=True)
+    with open(args.output, "w") as calibration_file:
+        json.dump(calibration, calibration_file, indent=2)
+    print(f"Wrote {device_kind} calibration for {args.model} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
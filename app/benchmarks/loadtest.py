@@ -0,0 +1,380 @@
+"""
+Load-test harness for the API, meant to run locally with the model stubbed out.
+
+It replays a mix of user actions at a Poisson arrival rate, with at most
+`--concurrency` actions in flight:
+
+- aoi: POST /aoi with a synthetic canvas image
+- predictor: a burst of /segment_predictor single-point clicks on one AOI,
+  separated by a short think time, like a user clicking around the map
+- automatic: POST /segment_automatic on one AOI
+- predictions: GET /predictions for one project
+
+Latency is measured from each action's scheduled arrival time, so time spent
+waiting for a free client slot counts and an overloaded server cannot hide
+behind a slowed-down client. The server RSS (including worker processes) is
+sampled while the test runs, and each endpoint reports the peak RSS seen while
+one of its requests was in flight. The report is compared against an SLO file
+and the exit status is 1 when any objective is missed.
+
+Usage (from the app directory; `--spawn` starts uvicorn with SAMGEO_STUB_MODEL=true):
+
+    python -m benchmarks.loadtest --spawn --duration 60 --rate 8 --concurrency 16 \\
+        --mix aoi=1,predictor=6,automatic=1,predictions=2 --slo benchmarks/slo.json
+
+Requires httpx; psutil is used for RSS when installed, /proc otherwise.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+import numpy as np
+import httpx
+from PIL import Image
+
+ENDPOINTS = ["aoi", "segment_predictor", "segment_automatic", "predictions"]
+SCENARIOS = {"aoi", "predictor", "automatic", "predictions"}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {sorted(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def canvas_image(size: int, seed: int) -> str:
+    """Returns a base64 PNG data URL of a random RGB image."""
+    rng = np.random.default_rng(seed)
+    array = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of a process and its children."""
+    try:
+        import psutil
+
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes if p.is_running())
+    except ImportError:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return 0
+
+
+class Recorder:
+    """Collects latencies, status codes and in-flight RSS peaks per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.inflight = defaultdict(int)
+        self.peak_rss = defaultdict(int)
+        self.peak_rss_total = 0
+        self.last_rss = 0
+
+    def sample_rss(self, rss: int):
+        self.last_rss = rss
+        self.peak_rss_total = max(self.peak_rss_total, rss)
+        for endpoint, count in self.inflight.items():
+            if count:
+                self.peak_rss[endpoint] = max(self.peak_rss[endpoint], rss)
+
+    async def request(self, client, endpoint, method, url, arrival, **kwargs):
+        self.inflight[endpoint] += 1
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finally:
+            self.inflight[endpoint] -= 1
+            # Requests shorter than the sampling interval still see the latest sample
+            self.peak_rss[endpoint] = max(self.peak_rss[endpoint], self.last_rss)
+        self.latencies[endpoint].append(time.perf_counter() - arrival)
+        self.statuses[endpoint][status] += 1
+        return status
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            latencies = np.array(self.latencies.get(endpoint, []))
+            statuses = self.statuses.get(endpoint, {})
+            count = int(sum(statuses.values()))
+            if not count:
+                continue
+            ok = sum(n for s, n in statuses.items() if isinstance(s, int) and s < 400)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            endpoints[endpoint] = {
+                "requests": count,
+                "throughput_rps": round(ok / duration, 3),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "error_rate": round(1 - ok / count, 4),
+                "rejected_429": statuses.get(429, 0),
+                "statuses": {str(s): n for s, n in statuses.items()},
+                "peak_rss_mb": round(self.peak_rss.get(endpoint, 0) / 1024**2, 1),
+            }
+        return {
+            "duration_s": round(duration, 1),
+            "peak_rss_mb": round(self.peak_rss_total / 1024**2, 1),
+            "endpoints": endpoints,
+        }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.aois = []  # (project, id, bbox)
+        self.images = [canvas_image(args.image_size, seed) for seed in range(4)]
+
+    def aoi_payload(self, project):
+        # Small AOIs around Bologna at zoom 18, like a user panning the map
+        lon = 11.33 + self.rng.random() * 0.02
+        lat = 44.49 + self.rng.random() * 0.02
+        bbox = [lon, lat, lon + 0.003, lat + 0.002]
+        payload = {
+            "project": project,
+            "id": uuid.uuid4().hex[:12],
+            "bbox": bbox,
+            "zoom": 18,
+            "canvas_image": self.rng.choice(self.images),
+        }
+        return payload
+
+    def random_point(self, bbox):
+        return [
+            bbox[0] + self.rng.random() * (bbox[2] - bbox[0]),
+            bbox[1] + self.rng.random() * (bbox[3] - bbox[1]),
+        ]
+
+    async def setup(self, client):
+        """Creates the AOIs the segmentation scenarios run against; not measured."""
+        for index in range(self.args.aois):
+            project = f"{self.args.project_prefix}{index % self.args.projects}"
+            payload = self.aoi_payload(project)
+            response = await client.post("/aoi", json=payload)
+            response.raise_for_status()
+            self.aois.append((project, payload["id"], payload["bbox"]))
+
+    async def scenario_aoi(self, client, arrival):
+        project = f"{self.args.project_prefix}{self.rng.randrange(self.args.projects)}"
+        await self.recorder.request(
+            client, "aoi", "POST", "/aoi", arrival, json=self.aoi_payload(project)
+        )
+
+    async def scenario_predictor(self, client, arrival):
+        project, id, bbox = self.rng.choice(self.aois)
+        for click in range(self.args.burst):
+            if click:
+                await asyncio.sleep(self.args.think_ms / 1000)
+                arrival = time.perf_counter()
+            payload = {
+                "project": project,
+                "id": id,
+                "bbox": bbox,
+                "zoom": 18,
+                "action_type": "single_point",
+                "point_coords": [self.random_point(bbox)],
+                "point_labels": [1],
+            }
+            await self.recorder.request(
+                client, "segment_predictor", "POST", "/segment_predictor", arrival, json=payload
+            )
+
+    async def scenario_automatic(self, client, arrival):
+        project, id, bbox = self.rng.choice(self.aois)
+        payload = {"project": project, "id": id, "bbox": bbox, "zoom": 18}
+        if self.args.automatic_quality:
+            payload["quality"] = self.args.automatic_quality
+        await self.recorder.request(
+            client, "segment_automatic", "POST", "/segment_automatic", arrival, json=payload
+        )
+
+    async def scenario_predictions(self, client, arrival):
+        project, _, _ = self.rng.choice(self.aois)
+        await self.recorder.request(
+            client, "predictions", "GET", "/predictions", arrival, params={"project_id": project}
+        )
+
+    async def sample_rss(self, pid, stop):
+        while not stop.is_set():
+            self.recorder.sample_rss(rss_bytes(pid))
+            await asyncio.sleep(0.1)
+
+    async def run(self, pid=None):
+        args = self.args
+        weights = parse_mix(args.mix)
+        names, cumulative = list(weights), np.cumsum(list(weights.values()))
+        slots = asyncio.Semaphore(args.concurrency)
+        timeout = httpx.Timeout(args.timeout)
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+            await self.setup(client)
+
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self.sample_rss(pid, stop)) if pid else None
+
+            async def action(name, arrival):
+                async with slots:
+                    await getattr(self, f"scenario_{name}")(client, arrival)
+
+            tasks = []
+            start = time.perf_counter()
+            next_arrival = start
+            while next_arrival < start + args.duration:
+                await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+                pick = self.rng.random() * cumulative[-1]
+                name = names[int(np.searchsorted(cumulative, pick, side="right"))]
+                tasks.append(asyncio.create_task(action(name, next_arrival)))
+                next_arrival += self.rng.expovariate(args.rate)
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+
+            stop.set()
+            if sampler:
+                await sampler
+        return self.recorder.report(duration)
+
+
+def compare_slo(report: dict, slo: dict) -> list:
+    """
+    Returns the missed objectives. SLO keys per endpoint are "max_p50_ms",
+    "max_p95_ms", "max_p99_ms", "max_error_rate", "min_throughput_rps" and
+    "max_peak_rss_mb"; "max_peak_rss_mb" may also be set at the top level.
+    """
+    checks = {
+        "max_p50_ms": ("p50_ms", max),
+        "max_p95_ms": ("p95_ms", max),
+        "max_p99_ms": ("p99_ms", max),
+        "max_error_rate": ("error_rate", max),
+        "min_throughput_rps": ("throughput_rps", min),
+        "max_peak_rss_mb": ("peak_rss_mb", max),
+    }
+    breaches = []
+    for endpoint, objectives in slo.get("endpoints", {}).items():
+        measured = report["endpoints"].get(endpoint)
+        if measured is None:
+            continue
+        for objective, limit in objectives.items():
+            metric, kind = checks[objective]
+            value = measured[metric]
+            if (kind is max and value > limit) or (kind is min and value < limit):
+                breaches.append(f"{endpoint} {metric}={value} (SLO {objective}={limit})")
+    if "max_peak_rss_mb" in slo and report["peak_rss_mb"] > slo["max_peak_rss_mb"]:
+        breaches.append(f"peak_rss_mb={report['peak_rss_mb']} (SLO max_peak_rss_mb={slo['max_peak_rss_mb']})")
+    return breaches
+
+
+def print_report(report: dict):
+    print(f"\nDuration {report['duration_s']}s, server peak RSS {report['peak_rss_mb']} MB")
+    header = f"{'endpoint':<18} {'reqs':>6} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'429':>5} {'RSS MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in report["endpoints"].items():
+        print(
+            f"{endpoint:<18} {row['requests']:>6} {row['throughput_rps']:>7.2f} {row['p50_ms']:>8.0f} "
+            f"{row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {row['error_rate']:>7.1%} "
+            f"{row['rejected_429']:>5} {row['peak_rss_mb']:>8.0f}"
+        )
+
+
+def spawn_server(port: int):
+    """Starts the API with the stub model and waits until it answers."""
+    env = {**os.environ, "SAMGEO_STUB_MODEL": "true"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=2).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("Server did not start within 120s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Start a stub-model server on --port")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server-pid", type=int, default=None, help="PID to sample RSS from")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of arrivals")
+    parser.add_argument("--rate", type=float, default=5, help="Mean actions per second")
+    parser.add_argument("--concurrency", type=int, default=16, help="Max actions in flight")
+    parser.add_argument("--mix", default="aoi=1,predictor=6,automatic=1,predictions=2")
+    parser.add_argument("--burst", type=int, default=5, help="Clicks per predictor burst")
+    parser.add_argument("--think-ms", type=float, default=300, help="Pause between clicks")
+    parser.add_argument("--automatic-quality", default="fast", choices=["fast", "balanced", "high", ""])
+    parser.add_argument("--projects", type=int, default=2)
+    parser.add_argument("--project-prefix", default="loadtest")
+    parser.add_argument("--aois", type=int, default=6, help="AOIs created before the run")
+    parser.add_argument("--image-size", type=int, default=512, help="Canvas image side in pixels")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slo", default=os.path.join(os.path.dirname(__file__), "slo.json"))
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    server = None
+    pid = args.server_pid
+    if args.spawn:
+        server = spawn_server(args.port)
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        pid = server.pid
+    try:
+        report = asyncio.run(LoadTest(args).run(pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(30)
+
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("output",)}
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    breaches = []
+    if args.slo and os.path.exists(args.slo):
+        with open(args.slo) as slo_file:
+            breaches = compare_slo(report, json.load(slo_file))
+        print(f"\nSLO {args.slo}: {'FAIL' if breaches else 'PASS'}")
+        for breach in breaches:
+            print(f"  - {breach}")
+    sys.exit(1 if breaches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
 import os
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from routes.predictions import router as predictions_routes
 from routes.decoder import router as decoder_routes
 from routes.encoder import router as encoder_routes
+from routes.metrics import router as metrics_routes
 
 from utils.utils import check_gpu
+from utils.admission import AdmissionRejected
+from utils.persistence import WriteBehindStaticFiles, write_behind
+from utils.worker_pool import inference_pool
+from utils.sam2 import preload_default_models
 from middleware import log_request_middleware
 
 app = FastAPI()
@@ -29,6 +34,15 @@ app.add_middleware(
 app.middleware("http")(log_request_middleware)
 
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/")
 async def status():
     """
@@ -43,11 +57,25 @@ async def status():
 
 app.include_router(encoder_routes)
 app.include_router(decoder_routes)
-app.mount("/files", StaticFiles(directory="public"), name="public")
+app.mount("/files", WriteBehindStaticFiles(directory="public"), name="public")
 app.include_router(predictions_routes)
+app.include_router(metrics_routes)
 
 
 @app.on_event("startup")
 async def startup_event():
     os.makedirs("public", exist_ok=True)
     os.makedirs("tmp", exist_ok=True)
+    if inference_pool is not None:
+        # Each worker process loads its own models
+        inference_pool.start()
+    else:
+        await asyncio.to_thread(preload_default_models)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Make sure queued artifacts are on disk before the process exits
+    if inference_pool is not None:
+        await asyncio.to_thread(inference_pool.stop)
+    await asyncio.to_thread(write_behind.flush)
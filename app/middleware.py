@@ -1,12 +1,33 @@
 import time
+import uuid
 from fastapi import Request
-from utils.logger_config import log
+from utils.logger_config import access_log, request_id
+
+REQUEST_ID_HEADER = "X-Request-ID"
 
 
 async def log_request_middleware(request: Request, call_next):
+    # Reuse the caller's id so a request can be followed across services
+    rid = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    token = request_id.set(rid[:64])
     request_start_time = time.monotonic()
-    response = await call_next(request)
-    request_duration = time.monotonic() - request_start_time
-    log_data = {"method": request.method, "path": request.url.path, "duration": request_duration}
-    log.info(log_data)
-    return response
+    try:
+        response = await call_next(request)
+        request_duration = time.monotonic() - request_start_time
+        response.headers[REQUEST_ID_HEADER] = rid[:64]
+        access_log.info(
+            "%s %s %d in %.3fs",
+            request.method,
+            request.url.path,
+            response.status_code,
+            request_duration,
+            extra={
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration": round(request_duration, 4),
+            },
+        )
+        return response
+    finally:
+        request_id.reset(token)
@@ -1,30 +1,69 @@
-import asyncio
 import logging
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
+import functools
+from fastapi import APIRouter, Request
 from schemas.segment import SegmentRequestBase, SegmentResponseBase
 from utils.sam2 import detect_automatic_sam2, detect_predictor_sam2
 from utils.logger_config import log
+from utils.singleflight import inflight, request_key
+from utils.admission import admission
+from utils.profiling import PROFILE_HEADER, ProfileSession, should_profile
+from utils.responses import geojson_response
+from utils.utils import aoi_fingerprint
+from utils.worker_pool import inference_pool
 
 router = APIRouter()
 
 
+async def run_segmentation(kind, priority, fn, request, http_request):
+    """
+    Runs a segmentation function through deduplication, admission control and,
+    when requested, profiling. With an inference pool, the function runs in the
+    worker process owning the AOI and the result comes back already encoded.
+
+    Returns:
+        tuple: The segmentation result and extra response headers.
+    """
+    session = None
+    if should_profile(http_request.headers.get(PROFILE_HEADER)):
+        session = ProfileSession(f"{kind}_{request.project}_{request.id}")
+        if inference_pool is None:
+            fn = session.wrap(fn)
+
+    if inference_pool is not None:
+        fn = functools.partial(inference_pool.run, kind, session=session)
+
+    if session:
+        # Profiled requests get their own computation so the trace matches this request
+        kind = f"{kind}:profiled"
+
+    key = request_key(kind, request, aoi_fingerprint(request.project, request.id))
+    result = await inflight.do(
+        key,
+        lambda: admission.run(priority, request.project, fn, request=request),
+    )
+
+    headers = {}
+    if session and session.urls:
+        headers["X-Profile-Urls"] = ",".join(session.urls)
+    return result, headers
+
+
 @router.post(
     "/segment_automatic",
     tags=["Decoder"],
     description="Segment the images using automatic options",
     # response_model=SegmentResponseBase,
 )
-async def automatic_detection(request: SegmentRequestBase):
-    zoom_int = int(request.zoom)
-    result = await asyncio.to_thread(detect_automatic_sam2, request=request)
+async def automatic_detection(request: SegmentRequestBase, http_request: Request):
+    result, headers = await run_segmentation(
+        "automatic", "automatic", detect_automatic_sam2, request, http_request
+    )
 
     # Check if an error occurred
     if isinstance(result, dict) and "error" in result:
-        return JSONResponse(content=result, status_code=400)
+        return await geojson_response(result, http_request, status_code=400, headers=headers)
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return await geojson_response(result, http_request, headers=headers)
 
 
 @router.post(
@@ -33,15 +72,21 @@ async def automatic_detection(request: SegmentRequestBase):
     description="Segment the images using point input prompts",
     response_model=SegmentResponseBase,
 )
-async def predictor_promts(request: SegmentRequestBase):
-    log.info("Received request for predictor prompts with the following data: %s", request)
+async def predictor_promts(request: SegmentRequestBase, http_request: Request):
+    # Summarise instead of logging the whole request, point lists included, on every click
+    log.info(
+        "Predictor request for %s/%s: %s with %d points",
+        request.project,
+        request.id,
+        request.action_type,
+        len(request.point_coords or []),
+    )
 
-    result = await asyncio.to_thread(
-        detect_predictor_sam2,
-        request=request,
+    result, headers = await run_segmentation(
+        "predictor", "interactive", detect_predictor_sam2, request, http_request
     )
 
     if isinstance(result, dict) and "error" in result:
-        return JSONResponse(content=result, status_code=400)
+        return await geojson_response(result, http_request, status_code=400, headers=headers)
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return await geojson_response(result, http_request, headers=headers)
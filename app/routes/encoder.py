@@ -1,6 +1,5 @@
 import os
 import time
-import json
 import base64
 from samgeo import tms_to_geotiff
 
@@ -10,6 +9,8 @@ from schemas.aoi import AOIRequestBase, AOIResponseBase
 from utils.convert import convert_image_to_geotiff
 from utils.logger_config import log
 from utils.utils import base_files_names
+from utils.persistence import write_behind
+from utils.responses import dumps
 
 router = APIRouter()
 
@@ -49,10 +50,10 @@ async def save_image(request: AOIRequestBase):
             convert_image_to_geotiff(png_file_path, tif_file_path, bbox)
 
             # Improved logging with more details
-            log.info(f"Image saved at: {png_file_path}")
-            log.info(f"GeoTIFF saved at: {tif_file_path}")
-            log.info(f"Image URL: {png_file_url}")
-            log.info(f"GeoTIFF URL: {tif_file_url}")
+            log.info("Image saved at: %s", png_file_path)
+            log.info("GeoTIFF saved at: %s", tif_file_path)
+            log.info("Image URL: %s", png_file_url)
+            log.info("GeoTIFF URL: %s", tif_file_url)
 
             # Prepare response
             resp_info = AOIResponseBase(
@@ -64,13 +65,13 @@ async def save_image(request: AOIRequestBase):
                 tif_url=tif_file_url,
             )
 
-            # Save response as JSON
-            with open(json_file_path, "w") as json_file:
-                json.dump(resp_info.dict(), json_file)
+            # Save response as JSON, off the response path
+            metadata = resp_info.dict()
+            await write_behind.write_file_async(json_file_path, lambda: dumps(metadata))
 
             return resp_info
 
     except Exception as e:
         # Log the error and return a 500 HTTP error
-        log.error(f"Error processing request for project '{project}', id '{id}': {str(e)}")
+        log.error("Error processing request for project '%s', id '%s': %s", project, id, e)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
@@ -0,0 +1,55 @@
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from utils.singleflight import inflight
+from utils.admission import admission
+from utils.embedding_store import embedding_store
+from utils.sam2 import models
+from utils.persistence import write_behind
+from utils.worker_pool import inference_pool
+from utils.logger_config import log_metrics
+from utils.profiling import PROFILE_HEADER, PROFILING_ENABLED, profile_path, token_accepted
+
+router = APIRouter()
+
+
+@router.get(
+    "/metrics",
+    tags=["Utils"],
+    description="Service counters for deduplication, admission control, embeddings, models and workers",
+)
+async def metrics():
+    return {
+        "singleflight": inflight.metrics(),
+        "admission": admission.metrics(),
+        "embeddings": embedding_store.metrics(),
+        "models": models.metrics(),
+        "write_behind": write_behind.metrics(),
+        "inference_pool": inference_pool.metrics() if inference_pool else None,
+        "logging": log_metrics(),
+    }
+
+
+@router.get(
+    "/models",
+    tags=["Utils"],
+    description="List the available SAM2 models and the ones currently loaded",
+)
+async def list_models():
+    return models.metrics()
+
+
+@router.get(
+    "/profiles/{name}",
+    tags=["Utils"],
+    description="Download a profiling trace. Requires the X-Profile header when PROFILING_TOKEN is set",
+)
+async def get_profile(name: str, token: Optional[str] = Header(None, alias=PROFILE_HEADER)):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not token_accepted(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path)
@@ -1,14 +1,69 @@
 import os
 import json
+import tempfile
+import itertools
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi import UploadFile, File, Depends
 from utils.utils import get_timestamp
+from utils.responses import dumps
+from utils.spatial_store import spatial_store
 from schemas.geojson import JSONDataBase
 
 router = APIRouter()
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
+STREAM_CHUNK_FEATURES = 500
+
+
+def get_project_dir(project_id: str) -> Path:
+    """Resolves a project directory inside `public`, rejecting paths that escape it."""
+    public_dir = Path("public").resolve() / Path(project_id)
+    if not str(public_dir.resolve()).startswith(str(Path("public").resolve())):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not public_dir.exists() or not public_dir.is_dir():
+        raise HTTPException(status_code=404, detail="Project not found")
+    return public_dir
+
+
+def parse_bbox(bbox: str) -> tuple:
+    try:
+        values = tuple(float(value) for value in bbox.split(","))
+    except ValueError:
+        values = ()
+    if len(values) != 4:
+        raise HTTPException(
+            status_code=400, detail="bbox must be 'min_lon,min_lat,max_lon,max_lat'"
+        )
+    return values
+
+
+def stream_feature_collection(features, extra=None):
+    """
+    Streams features as a GeoJSON FeatureCollection, encoding them in chunks.
+
+    Args:
+        features (Iterator[dict]): GeoJSON features to stream.
+        extra (Callable): Optional function returning foreign members appended after
+            the features, called once all of them have been streamed.
+
+    Yields:
+        bytes: Parts of the encoded FeatureCollection.
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    while True:
+        chunk = [dumps(feature) for feature in itertools.islice(features, STREAM_CHUNK_FEATURES)]
+        if not chunk:
+            break
+        yield (b"" if first else b",") + b",".join(chunk)
+        first = False
+    yield b"]"
+    for key, value in (extra() if extra else {}).items():
+        yield b"," + dumps(key) + b":" + dumps(value)
+    yield b"}"
 
 
 @router.get(
@@ -91,3 +146,67 @@ async def upload_geojson(request: JSONDataBase):
 
     file_url = f"{BASE_URL}/files/{request.project}/{geojson_file_name}"
     return {"project": request.project, "file_url": file_url}
+
+
+@router.get(
+    "/predictions/query",
+    tags=["Utils"],
+    description="Stream the segmentation results of a project intersecting a bbox, paginated",
+)
+def query_predictions(
+    project_id: str,
+    bbox: str = Query(..., description="min_lon,min_lat,max_lon,max_lat"),
+    cursor: int = Query(0, ge=0, description="next_cursor of the previous page"),
+    limit: int = Query(1000, ge=1, le=50000),
+):
+    get_project_dir(project_id)
+    bounds = parse_bbox(bbox)
+
+    # One extra feature tells whether there is a next page
+    features = spatial_store.query(project_id, bounds, cursor, limit + 1)
+    page = features[:limit]
+    pagination = {
+        "cursor": cursor,
+        "limit": limit,
+        "returned": len(page),
+        "next_cursor": page[-1]["id"] if len(features) > limit else None,
+    }
+
+    return StreamingResponse(
+        stream_feature_collection(iter(page), lambda: pagination),
+        media_type="application/geo+json",
+    )
+
+
+@router.get(
+    "/predictions/export",
+    tags=["Utils"],
+    description="Export all segmentation results of a project as one GeoJSON or GeoPackage file",
+)
+def export_predictions(project_id: str, format: Literal["geojson", "gpkg"] = "geojson"):
+    get_project_dir(project_id)
+    store_path = spatial_store.path(project_id)
+    if not os.path.exists(store_path):
+        raise HTTPException(status_code=404, detail="No segmentation results for this project")
+
+    file_name = f"{project_id}_{get_timestamp()}"
+    if format == "gpkg":
+        # Send a consistent copy; the live file may be appended to while it is sent
+        snapshot = tempfile.NamedTemporaryFile(dir="tmp", suffix=".gpkg", delete=False)
+        snapshot.close()
+        try:
+            spatial_store.snapshot(project_id, snapshot.name)
+        except Exception:
+            os.remove(snapshot.name)
+            raise
+        return FileResponse(
+            snapshot.name,
+            media_type="application/geopackage+sqlite3",
+            filename=f"{file_name}.gpkg",
+            background=BackgroundTask(os.remove, snapshot.name),
+        )
+    return StreamingResponse(
+        stream_feature_collection(spatial_store.iter_features(project_id)),
+        media_type="application/geo+json",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}.geojson"'},
+    )
@@ -1,8 +1,33 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Tuple, Optional, Any, Dict, Literal
 
+SAM2ModelId = Literal[
+    "sam2-hiera-tiny", "sam2-hiera-small", "sam2-hiera-base-plus", "sam2-hiera-large"
+]
+
+
+class MaskCleanupOptions(BaseModel):
+    open_px: int = Field(
+        1, ge=0, le=16, description="Radius in pixels of the opening that removes speckles and thin spurs, 0 to disable"
+    )
+    close_px: int = Field(
+        1, ge=0, le=16, description="Radius in pixels of the closing that bridges small cracks, 0 to disable"
+    )
+    max_hole_px: int = Field(
+        64, ge=0, description="Holes up to this area in pixels are filled, 0 to disable"
+    )
+    min_area_px: int = Field(
+        25, ge=0, description="Regions smaller than this area in pixels are removed, 0 to disable"
+    )
+    smooth_sigma: float = Field(
+        0.0, ge=0, le=8, description="Gaussian sigma in pixels to smooth staircase edges, 0 to disable"
+    )
+
 
 class SegmentRequestBase(BaseModel):
+    # Allow the "model_id" field
+    model_config = ConfigDict(protected_namespaces=())
+
     project: str = Field(..., description="Project ID identifier")
     id: str = Field(..., description="Unique identifier for AOI segmentation request")
     bbox: List[float] = Field(
@@ -35,6 +60,27 @@ class SegmentRequestBase(BaseModel):
     area_val: float = Field(
         0.0, description="Area threshold. Features with an area smaller than this value will not be returned. Default is 0."
     )
+    latency_budget: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Optional time budget in seconds for /segment_automatic. The most detailed generator settings predicted to fit the budget are used.",
+    )
+    model_id: Optional[SAM2ModelId] = Field(
+        None,
+        description="Optional SAM2 model variant. Smaller models are faster; the default is set by DEFAULT_PREDICTOR_MODEL / DEFAULT_AUTOMATIC_MODEL (sam2-hiera-large).",
+    )
+    quality: Optional[Literal["fast", "balanced", "high"]] = Field(
+        None,
+        description="Optional quality tier for /segment_automatic, takes precedence over latency_budget. Default is 'high'.",
+    )
+    mask_cleanup: Optional[MaskCleanupOptions] = Field(
+        None,
+        description="Optional raster cleanup of the masks before they are converted to polygons. Send {} for the default settings.",
+    )
+    incremental: Optional[bool] = Field(
+        None,
+        description="For /segment_automatic, reuse results of earlier overlapping AOIs of the project at the same zoom and settings, and only segment the new area. Default is set by INCREMENTAL_AUTOMATIC (true).",
+    )
 
     @field_validator("bbox", mode="before")
     def validate_bbox(cls, bbox):
@@ -67,3 +113,6 @@ class SegmentResponseBase(BaseModel):
     features: List[Dict[str, Any]] = Field(
         ..., description="A list of GeoJSON features containing geometries and properties"
     )
+    metadata: Optional[Dict[str, Any]] = Field(
+        None, description="Processing details, e.g. the automatic quality tier and its timings"
+    )
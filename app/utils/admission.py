@@ -0,0 +1,291 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+from utils.logger_config import log
+from utils.worker_pool import INFERENCE_WORKERS
+
+# Lower value runs first: interactive clicks always go ahead of automatic/bulk work
+PRIORITIES = {"interactive": 0, "automatic": 1}
+
+# With inference worker processes, one slot per worker keeps them all busy
+SEGMENT_CONCURRENCY = int(os.getenv("SEGMENT_CONCURRENCY", str(max(2, INFERENCE_WORKERS))))
+# Slots automatic/bulk work can never take, so clicks are not starved by long automatic runs
+SEGMENT_INTERACTIVE_RESERVED = int(os.getenv("SEGMENT_INTERACTIVE_RESERVED", "1"))
+# Queued requests allowed per class; each class is bounded on its own, so a backlog of
+# automatic runs never takes queue room from interactive clicks
+_DEFAULT_QUEUE_SIZE = os.getenv("SEGMENT_MAX_QUEUE_SIZE", "64")
+MAX_QUEUE_SIZE = {
+    "interactive": int(os.getenv("SEGMENT_MAX_QUEUE_SIZE_INTERACTIVE", _DEFAULT_QUEUE_SIZE)),
+    "automatic": int(os.getenv("SEGMENT_MAX_QUEUE_SIZE_AUTOMATIC", _DEFAULT_QUEUE_SIZE)),
+}
+MAX_QUEUE_DELAY = {
+    "interactive": float(os.getenv("SEGMENT_MAX_QUEUE_DELAY_INTERACTIVE", "10")),
+    "automatic": float(os.getenv("SEGMENT_MAX_QUEUE_DELAY_AUTOMATIC", "120")),
+}
+INITIAL_SERVICE_TIME = {"interactive": 1.0, "automatic": 10.0}
+EWMA_ALPHA = 0.2
+
+
+def parse_project_weights(value: str) -> Dict[str, float]:
+    """
+    Parses project weights from a "project=weight,project=weight" string.
+
+    Args:
+        value (str): Raw value, usually taken from the PROJECT_WEIGHTS env var.
+
+    Returns:
+        dict: Mapping of project name to weight. Unlisted projects weigh 1.
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        project, _, weight = item.partition("=")
+        weights[project.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued within its latency budget."""
+
+    def __init__(self, priority: str, retry_after: int, reason: str):
+        super().__init__(f"Segmentation queue is full for {priority} requests: {reason}")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("start_tag", "seq", "project", "cost", "future", "cancelled")
+
+    def __init__(self, start_tag, seq, project, cost, future):
+        self.start_tag = start_tag
+        self.seq = seq
+        self.project = project
+        self.cost = cost
+        self.future = future
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.start_tag, self.seq) < (other.start_tag, other.seq)
+
+
+class AdmissionController:
+    """
+    Bounded, priority-aware scheduler for segmentation work.
+
+    Requests are admitted only if their predicted queueing delay, computed from
+    measured service times, fits the budget of their priority class. Automatic work
+    runs on at most `concurrency - interactive_reserved` slots, so interactive requests
+    always have a slot of their own. Within a class, start-time fair queueing shares
+    the workers across projects by weight.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = SEGMENT_CONCURRENCY,
+        max_queue_size: Dict[str, int] = MAX_QUEUE_SIZE,
+        max_queue_delay: Dict[str, float] = MAX_QUEUE_DELAY,
+        project_weights: Dict[str, float] = None,
+        interactive_reserved: int = SEGMENT_INTERACTIVE_RESERVED,
+    ):
+        self.concurrency = max(concurrency, 1)
+        # Slots each class may hold; with a single slot nothing can be reserved
+        self.max_running = {
+            "interactive": self.concurrency,
+            "automatic": max(1, self.concurrency - interactive_reserved),
+        }
+        self.max_queue_size = max_queue_size
+        self.max_queue_delay = max_queue_delay
+        self.project_weights = project_weights or {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="segment"
+        )
+        self._seq = itertools.count()
+        self._running: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._queues: Dict[str, List[_Ticket]] = {priority: [] for priority in PRIORITIES}
+        self._queued_work: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish: Dict[tuple, float] = {}
+        self._service_time: Dict[str, float] = dict(INITIAL_SERVICE_TIME)
+        self.stats = {
+            priority: {"admitted": 0, "rejected": 0, "completed": 0} for priority in PRIORITIES
+        }
+
+    def _queue_length(self, priority: str = None) -> int:
+        """Queued requests of one class, or of every class when `priority` is None."""
+        queues = self._queues.values() if priority is None else [self._queues[priority]]
+        return sum(1 for queue in queues for ticket in queue if not ticket.cancelled)
+
+    def _can_start(self, priority: str) -> bool:
+        return (
+            sum(self._running.values()) < self.concurrency
+            and self._running[priority] < self.max_running[priority]
+        )
+
+    def _predicted_wait(self, priority: str) -> float:
+        """
+        Seconds a new request of `priority` is expected to wait for a worker.
+
+        Only the slots the class can use count: at most its `max_running`, minus
+        those held by lower priority work, which is never preempted but cannot
+        take the reserved slots either.
+        """
+        rank = PRIORITIES[priority]
+        ahead = sum(
+            work for other, work in self._queued_work.items() if PRIORITIES[other] <= rank
+        )
+        if self._can_start(priority) and not ahead:
+            return 0.0
+        # Running requests are assumed to be half way through on average
+        running, lower, lower_running = 0.0, 0, 0.0
+        for other, count in self._running.items():
+            remaining = count * self._service_time[other] / 2
+            if PRIORITIES[other] <= rank:
+                running += remaining
+            else:
+                lower += count
+                lower_running += remaining
+        slots = min(self.max_running[priority], self.concurrency - lower)
+        if slots < 1:
+            # Lower priority work holds every slot, e.g. with a single one
+            return (ahead + running + lower_running) / self.concurrency
+        return (ahead + running) / slots
+
+    def _admit(self, priority: str):
+        wait = self._predicted_wait(priority)
+        reason = None
+        queued = self._queue_length(priority)
+        if queued >= self.max_queue_size[priority]:
+            reason = f"{queued} {priority} requests queued"
+        elif wait > self.max_queue_delay[priority]:
+            reason = f"predicted wait {wait:.1f}s exceeds {self.max_queue_delay[priority]:.1f}s"
+        if reason:
+            self.stats[priority]["rejected"] += 1
+            retry_after = max(1, math.ceil(wait or self._service_time[priority]))
+            log.warning("Rejecting %s request: %s", priority, reason)
+            raise AdmissionRejected(priority, retry_after, reason)
+
+    def _charge(self, priority: str, project: str) -> tuple:
+        """Computes the fair-queueing start tag of a request and charges its project."""
+        cost = self._service_time[priority]
+        weight = self.project_weights.get(project, 1.0)
+        start_tag = max(
+            self._virtual_time[priority], self._last_finish.get((priority, project), 0.0)
+        )
+        self._last_finish[(priority, project)] = start_tag + cost / weight
+        return start_tag, cost
+
+    def _enqueue(self, priority: str, project: str) -> _Ticket:
+        start_tag, cost = self._charge(priority, project)
+        ticket = _Ticket(
+            start_tag, next(self._seq), project, cost, asyncio.get_running_loop().create_future()
+        )
+        heapq.heappush(self._queues[priority], ticket)
+        self._queued_work[priority] += cost
+        return ticket
+
+    def _dispatch(self):
+        """Hands free workers to the next queued tickets, highest priority first."""
+        for priority in sorted(PRIORITIES, key=PRIORITIES.get):
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._queued_work[priority] -= ticket.cost
+                self._virtual_time[priority] = ticket.start_tag
+                self._running[priority] += 1
+                ticket.future.set_result(True)
+
+    async def _acquire(self, priority: str, project: str):
+        self._admit(priority)
+        self.stats[priority]["admitted"] += 1
+
+        rank = PRIORITIES[priority]
+        ahead = any(
+            self._queue_length(other) for other in PRIORITIES if PRIORITIES[other] <= rank
+        )
+        if self._can_start(priority) and not ahead:
+            # Charged like a queued request, so a project taking idle slots still
+            # falls behind the others once they queue
+            start_tag, _ = self._charge(priority, project)
+            self._virtual_time[priority] = start_tag
+            self._running[priority] += 1
+            return
+
+        ticket = self._enqueue(priority, project)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # The slot was granted just as the caller went away
+                self._release(priority, None)
+            else:
+                ticket.cancelled = True
+                self._queued_work[priority] -= ticket.cost
+            raise
+
+    def _release(self, priority: str, elapsed):
+        self._running[priority] -= 1
+        if elapsed is not None:
+            self.stats[priority]["completed"] += 1
+            self._service_time[priority] += EWMA_ALPHA * (elapsed - self._service_time[priority])
+        self._dispatch()
+
+    async def run(self, priority: str, project: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Runs `fn` on the segmentation worker pool once admitted.
+
+        Args:
+            priority (str): Priority class, "interactive" or "automatic".
+            project (str): Project used for weighted-fair scheduling.
+            fn (Callable): Blocking function to execute.
+
+        Returns:
+            Any: The result of `fn`.
+
+        Raises:
+            AdmissionRejected: If the request would wait longer than its class allows.
+        """
+        await self._acquire(priority, project)
+        start = time.monotonic()
+        context = contextvars.copy_context()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(context.run, fn, *args, **kwargs)
+        )
+
+        def on_done(f):
+            failed = f.cancelled() or f.exception() is not None
+            self._release(priority, None if failed else time.monotonic() - start)
+
+        # The worker slot is held until the thread actually finishes, even if the caller goes away
+        future.add_done_callback(on_done)
+        return await asyncio.shield(future)
+
+    def metrics(self) -> dict:
+        """Returns queue depth, running work and measured service time per class."""
+        return {
+            "concurrency": self.concurrency,
+            "classes": {
+                priority: {
+                    **self.stats[priority],
+                    "queued": self._queue_length(priority),
+                    "max_queued": self.max_queue_size[priority],
+                    "running": self._running[priority],
+                    "max_running": self.max_running[priority],
+                    "service_time_s": round(self._service_time[priority], 3),
+                    "predicted_wait_s": round(self._predicted_wait(priority), 3),
+                }
+                for priority in PRIORITIES
+            },
+        }
+
+
+admission = AdmissionController(
+    project_weights=parse_project_weights(os.getenv("PROJECT_WEIGHTS", ""))
+)
@@ -0,0 +1,178 @@
+import os
+import json
+import threading
+import rasterio
+from typing import Dict, Optional
+from utils.logger_config import log
+
+CALIBRATION_FILE = os.getenv(
+    "AUTOMATIC_CALIBRATION_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "calibration", "automatic_cost.json"),
+)
+DEFAULT_QUALITY = "high"
+EWMA_ALPHA = 0.2
+
+# Mask generator settings per quality tier, ordered from cheapest to most expensive.
+# "high" matches the settings the service has always used for /segment_automatic.
+AUTOMATIC_PROFILES = {
+    "fast": {
+        "points_per_side": 16,
+        "points_per_batch": 128,
+        "crop_n_layers": 0,
+        "use_m2m": False,
+    },
+    "balanced": {
+        "points_per_side": 24,
+        "points_per_batch": 64,
+        "crop_n_layers": 0,
+        "use_m2m": True,
+    },
+    "high": {
+        "points_per_side": 32,
+        "points_per_batch": 64,
+        "crop_n_layers": 1,
+        "use_m2m": True,
+    },
+}
+
+
+def device_type(device) -> str:
+    """Returns the calibration key for a torch device, e.g. "cuda" for "cuda:0"."""
+    return str(device).split(":")[0]
+
+
+def image_megapixels(tif_file_path: str) -> float:
+    """Reads the raster size from the GeoTIFF header without loading the pixels."""
+    with rasterio.open(tif_file_path) as src:
+        return src.width * src.height / 1e6
+
+
+class AutomaticCostModel:
+    """
+    Predicts /segment_automatic run time per quality tier from image size.
+
+    Predictions come from a linear model (intercept + seconds per megapixel) per
+    device type and, when calibrated, per model, loaded from the calibration file
+    written by `benchmarks/calibrate_automatic.py`. A running correction factor per
+    model and tier keeps the predictions in line with the times measured in production.
+    Latency budgets are only honored on devices (or models) the calibration script
+    has measured, which it marks with `"calibrated": true`; the bundled coefficients
+    of other devices are estimates.
+    """
+
+    def __init__(self, calibration_file: str = CALIBRATION_FILE):
+        self.calibration_file = calibration_file
+        self.coefficients = self._load()
+        self._correction: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.calibration_file, "r") as calibration:
+                return json.load(calibration)["devices"]
+        except Exception as e:
+            log.error("Could not load automatic calibration from %s: %s", self.calibration_file, e)
+            return {}
+
+    def calibrated(self, device: str, model_id: Optional[str] = None) -> bool:
+        """
+        Whether the coefficients used for a device and model were measured on such a
+        device. Models without their own coefficients use the device-wide ones.
+        """
+        device_coefficients = self.coefficients.get(device, {})
+        model_coefficients = device_coefficients.get("models", {}).get(model_id)
+        if model_coefficients:
+            return bool(model_coefficients.get("calibrated"))
+        return bool(device_coefficients.get("calibrated"))
+
+    def _coefficients(self, quality: str, device: str, model_id: Optional[str]):
+        device_coefficients = self.coefficients.get(device, {})
+        model_coefficients = device_coefficients.get("models", {}).get(model_id, {})
+        return model_coefficients.get(quality) or device_coefficients.get(quality)
+
+    def predict(
+        self, quality: str, megapixels: float, device: str, model_id: Optional[str] = None
+    ) -> Optional[float]:
+        """
+        Predicts the run time in seconds of a quality tier.
+
+        Returns:
+            float: Predicted seconds, or None if the device has no calibration.
+        """
+        coefficients = self._coefficients(quality, device, model_id)
+        if not coefficients:
+            return None
+        seconds = coefficients["intercept_s"] + coefficients["s_per_mpx"] * megapixels
+        return seconds * self._correction.get((model_id, quality), 1.0)
+
+    def record(
+        self,
+        quality: str,
+        megapixels: float,
+        device: str,
+        actual: float,
+        model_id: Optional[str] = None,
+    ):
+        """Updates the correction factor of a model and tier with a measured run time."""
+        predicted = self.predict(quality, megapixels, device, model_id)
+        if not predicted:
+            return
+        with self._lock:
+            correction = self._correction.get((model_id, quality), 1.0)
+            ratio = actual / (predicted / correction)
+            self._correction[(model_id, quality)] = correction + EWMA_ALPHA * (ratio - correction)
+
+    def choose(
+        self,
+        megapixels: float,
+        device: str,
+        latency_budget: Optional[float] = None,
+        quality: Optional[str] = None,
+        model_id: Optional[str] = None,
+    ) -> Dict:
+        """
+        Picks the quality tier for an automatic segmentation request.
+
+        An explicit quality wins. Otherwise, with a latency budget, the most
+        expensive tier predicted to finish within the budget is chosen, falling back
+        to the cheapest tier. Without either, or when the device and model are not
+        calibrated, the default tier is used.
+
+        Args:
+            megapixels (float): Size of the AOI raster.
+            device (str): Device type, e.g. "cuda" or "cpu".
+            latency_budget (float): Optional time budget in seconds.
+            quality (str): Optional quality tier requested by the client.
+            model_id (str): SAM2 model the request runs on.
+
+        Returns:
+            dict: The chosen tier name, its predicted time in seconds, whether the
+            device and model are calibrated and whether the latency budget was ignored.
+        """
+        calibrated = self.calibrated(device, model_id)
+        budget_ignored = quality is None and latency_budget is not None and not calibrated
+        if budget_ignored:
+            log.info(
+                "Ignoring latency budget of %ss: %s has no calibration for %s on %s",
+                latency_budget,
+                self.calibration_file,
+                model_id,
+                device,
+            )
+        elif quality is None and latency_budget is not None:
+            tiers = list(AUTOMATIC_PROFILES)
+            quality = tiers[0]
+            for tier in tiers:
+                predicted = self.predict(tier, megapixels, device, model_id)
+                if predicted is not None and predicted <= latency_budget:
+                    quality = tier
+        quality = quality or DEFAULT_QUALITY
+        return {
+            "quality": quality,
+            "predicted_s": self.predict(quality, megapixels, device, model_id),
+            "calibrated": calibrated,
+            "budget_ignored": budget_ignored,
+        }
+
+
+cost_model = AutomaticCostModel()
@@ -1,13 +1,17 @@
 import rasterio
 from rasterio.transform import from_bounds
+from rasterio import features
 from PIL import Image
 import numpy as np
 import os
+import pandas as pd
 import geopandas as gpd
-import json
-from shapely.geometry import shape
+from shapely.geometry import shape, Polygon, MultiPolygon
 from typing import List,Optional,Dict
 from utils.logger_config import log
+from utils.persistence import write_behind
+from utils.responses import dumps
+from utils.mask_cleanup import clean_label_mask, clean_mask_stack
 
 
 def convert_image_to_geotiff(image_filename: str, tif_filename: str, bbox: List[float]):
@@ -49,22 +53,109 @@ def convert_image_to_geotiff(image_filename: str, tif_filename: str, bbox: List[
             dst.write(image_array[:, :, 1], 2)
             dst.write(image_array[:, :, 2], 3)
 
-        log.info(f"Converted {image_filename} to {tif_filename} with bbox: {bbox}")
+        log.info("Converted %s to %s with bbox: %s", image_filename, tif_filename, bbox)
         return tif_filename
 
     except Exception as e:
-        log.error(f"Error converting image to GeoTIFF: {str(e)}", exc_info=True)
+        log.error("Error converting image to GeoTIFF: %s", e, exc_info=True)
         raise
 
 
+def vectorize_mask(band: np.ndarray, transform, crs) -> gpd.GeoDataFrame:
+    """Returns one polygon per connected region of equal non-zero value of a mask band."""
+    shapes = features.shapes(band, mask=band != 0, transform=transform)
+    geometries, values = [], []
+    for geometry, value in shapes:
+        geometries.append(shape(geometry))
+        values.append(value)
+    return gpd.GeoDataFrame({"value": values}, geometry=geometries, crs=crs)
+
+
+def mask_to_geodataframe(mask_file_path: str, cleanup: Optional[dict] = None) -> gpd.GeoDataFrame:
+    """
+    Vectorizes a mask raster in memory, like samgeo's raster_to_vector but without
+    writing and re-reading a vector file.
+
+    Args:
+        mask_file_path (str): Path to the single-band mask GeoTIFF.
+        cleanup (dict): Optional mask cleanup settings applied before vectorizing,
+            see `utils.mask_cleanup.clean_label_mask`.
+
+    Returns:
+        gpd.GeoDataFrame: One polygon per connected region of equal non-zero value,
+        with the pixel value in the "value" column, in the raster CRS.
+    """
+    with rasterio.open(mask_file_path) as src:
+        band = src.read(1)
+        transform, crs = src.transform, src.crs
+
+    if cleanup:
+        band = clean_label_mask(band, **cleanup)
+    return vectorize_mask(band, transform, crs)
+
+
+def masks_to_geodataframes(
+    mask_file_paths: List[str], cleanup: Optional[dict] = None
+) -> List[gpd.GeoDataFrame]:
+    """
+    Vectorizes the binary masks of one request, e.g. one per prompt point,
+    cleaning them together in a single batch.
+
+    Args:
+        mask_file_paths (list): Paths to single-band mask GeoTIFFs of the same AOI.
+        cleanup (dict): Optional mask cleanup settings, see
+            `utils.mask_cleanup.clean_mask_stack`.
+
+    Returns:
+        list: One GeoDataFrame per mask, in the raster CRS.
+    """
+    bands = []
+    for mask_file_path in mask_file_paths:
+        with rasterio.open(mask_file_path) as src:
+            bands.append(src.read(1))
+            transform, crs = src.transform, src.crs
+
+    if cleanup:
+        cleaned = clean_mask_stack(np.stack(bands) != 0, **cleanup)
+        bands = [
+            np.where(mask, max(band.max(), 1), 0).astype(band.dtype)
+            for mask, band in zip(cleaned, bands)
+        ]
+    return [vectorize_mask(band, transform, crs) for band in bands]
+
+
+def convex_hull_multipolygons(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Replaces MultiPolygons by their convex hull, keeping other geometries as-is."""
+    gdf["geometry"] = gdf["geometry"].apply(
+        lambda geom: (
+            geom
+            if isinstance(geom, Polygon)
+            else geom.convex_hull if isinstance(geom, MultiPolygon) else geom
+        )
+    )
+    return gdf
+
+
 def read_simplify_and_filter_by_area(gpkg_file_path: Optional[str] = None, 
                                      geojson_obj: Optional[dict] = None, 
                                      simplify_tolerance: float = 0, 
                                      area_val: float = 0, 
-                                     geojson_file_path: Optional[str] = None) -> Dict:
-    
-    if gpkg_file_path:
-        log.info(f"Reading GeoPackage from {gpkg_file_path}.")
+                                     geojson_file_path: Optional[str] = None,
+                                     gdf: Optional[gpd.GeoDataFrame] = None,
+                                     filter_rows: Optional[pd.Series] = None) -> Dict:
+    """
+    Simplifies and area-filters segmentation results and returns them as GeoJSON.
+
+    Args:
+        filter_rows (pd.Series): Optional boolean mask of the rows to simplify and
+            filter, e.g. the new features of an incremental run. Other rows were
+            already processed with the same settings and are passed through.
+    """
+
+    if gdf is not None:
+        log.info("Using in-memory GeoDataFrame.")
+    elif gpkg_file_path:
+        log.info("Reading GeoPackage from %s.", gpkg_file_path)
         gdf = gpd.read_file(gpkg_file_path)
     elif geojson_obj:
         log.info("Reading GeoJSON object.")
@@ -75,26 +166,31 @@ def read_simplify_and_filter_by_area(gpkg_file_path: Optional[str] = None,
     if gdf.crs is None:
         gdf = gdf.set_crs(epsg=4326)
     
+    rows = gdf.index if filter_rows is None else gdf.index[filter_rows.to_numpy()]
     if simplify_tolerance > 0:
-        log.info(f"Simplifying geometries with tolerance {simplify_tolerance}.")
-        gdf['geometry'] = gdf['geometry'].simplify(simplify_tolerance, preserve_topology=True)
+        log.info("Simplifying geometries with tolerance %s.", simplify_tolerance)
+        gdf.loc[rows, 'geometry'] = gdf.loc[rows, 'geometry'].simplify(simplify_tolerance, preserve_topology=True)
     
     gdf_projected = gdf.to_crs(epsg=3395)
     
     gdf_projected['area_m2'] = gdf_projected['geometry'].area
     
     if area_val > 0:
-        log.info(f"Filtering geometries with area greater than {area_val} m².")
-        gdf_filtered = gdf_projected[gdf_projected['area_m2'] > area_val]
+        log.info("Filtering geometries with area greater than %s m².", area_val)
+        keep = gdf_projected['area_m2'] > area_val
+        if filter_rows is not None:
+            keep |= ~filter_rows.to_numpy()
+        gdf_filtered = gdf_projected[keep]
     else:
         gdf_filtered = gdf_projected
     
     gdf_filtered = gdf_filtered.to_crs(epsg=4326)
     
-    geojson_result = json.loads(gdf_filtered.to_json())
+    geojson_result = gdf_filtered.to_geo_dict()
     
     if geojson_file_path:
-        log.info(f"Saving the result as GeoJSON to {geojson_file_path}.")
-        gdf_filtered.to_file(geojson_file_path, driver="GeoJSON")
+        # Written off the response path; served from memory until it lands on disk
+        log.info("Queueing the result as GeoJSON to %s.", geojson_file_path)
+        write_behind.write_file(geojson_file_path, lambda: dumps(geojson_result))
         
     return geojson_result
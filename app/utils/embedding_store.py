@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import rasterio
+import torch
+from pathlib import Path
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+from utils.logger_config import log
+from utils.persistence import write_behind
+
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() == "true"
+EMBEDDING_STORE_MAX_BYTES = int(os.getenv("EMBEDDING_STORE_MAX_BYTES", str(20 * 1024**3)))
+# Outside the static root served under /files; share it between replicas like public/
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", os.path.join("data", "embeddings"))
+# Empty keeps the dtype the encoder produced, so stored features give the same masks as
+# fresh ones; e.g. "float16" halves the size at the cost of a cast on every load
+EMBEDDING_STORE_DTYPE = os.getenv("EMBEDDING_STORE_DTYPE", "")
+STORE_FORMAT_VERSION = 2
+
+_digest_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_digest_lock = threading.Lock()
+
+
+def raster_digest(tif_file_path: str) -> str:
+    """
+    Returns the SHA-256 of a raster file, cached per file size and modification time.
+
+    Args:
+        tif_file_path (str): Path to the AOI GeoTIFF.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    stat = os.stat(tif_file_path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_cache.get(tif_file_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    sha = hashlib.sha256()
+    with open(tif_file_path, "rb") as tif_file:
+        for chunk in iter(lambda: tif_file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _digest_cache[tif_file_path] = (signature, digest)
+    return digest
+
+
+class EmbeddingStore:
+    """
+    Disk-backed store of SAM2 image features, kept next to the AOI files.
+
+    Each entry lives in `{EMBEDDING_STORE_DIR}/{project}/{id}/{model_id}-{digest}`,
+    outside the static files, and holds one `.npy` file per feature tensor plus a
+    `meta.json`. Tensors are stored in their own dtype unless `EMBEDDING_STORE_DTYPE`
+    is set. The arrays are memory-mapped on load, so any replica sharing the volume
+    can reuse them without running the image encoder.
+    Entries are written atomically and evicted least-recently-used once the store
+    exceeds its size budget.
+    """
+
+    def __init__(
+        self,
+        root: str = EMBEDDING_STORE_DIR,
+        max_bytes: int = EMBEDDING_STORE_MAX_BYTES,
+        dtype: str = EMBEDDING_STORE_DTYPE,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # None stores every array in its own dtype
+        self.dtype = np.dtype(dtype) if dtype else None
+        self.stats = {"warm": 0, "hits": 0, "misses": 0, "saved": 0, "evicted": 0}
+        self._evict_lock = threading.Lock()
+
+    def _id_dir(self, project: str, id: str) -> Path:
+        return self.root / project / id
+
+    def entry_dir(self, project: str, id: str, model_id: str, digest: str) -> Path:
+        return self._id_dir(project, id) / f"{model_id}-v{STORE_FORMAT_VERSION}-{digest[:24]}"
+
+    def load(self, project: str, id: str, model_id: str, digest: str) -> Optional[dict]:
+        """
+        Loads an entry as memory-mapped arrays.
+
+        Returns:
+            dict: {"meta": dict, "arrays": {name: np.ndarray}}, or None if missing.
+        """
+        entry = self.entry_dir(project, id, model_id, digest)
+        meta_path = entry / "meta.json"
+        try:
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+            # Copy-on-write maps give writable arrays without reading the file up front
+            arrays = {
+                name: np.load(entry / f"{name}.npy", mmap_mode="c") for name in meta["arrays"]
+            }
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+        # The modification time of meta.json drives LRU eviction
+        os.utime(meta_path)
+        return {"meta": meta, "arrays": arrays}
+
+    def save(self, project: str, id: str, model_id: str, digest: str, arrays: dict, meta: dict):
+        """
+        Writes an entry atomically and drops older entries for the same AOI.
+
+        Args:
+            arrays (dict): Feature tensors as numpy arrays, keyed by name.
+            meta (dict): Extra metadata needed to restore the features.
+        """
+        entry = self.entry_dir(project, id, model_id, digest)
+        if entry.exists():
+            return
+        id_dir = self._id_dir(project, id)
+        id_dir.mkdir(parents=True, exist_ok=True)
+
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp-", dir=id_dir))
+        try:
+            for name, array in arrays.items():
+                np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array, dtype=self.dtype))
+            meta = {
+                **meta,
+                "model_id": model_id,
+                "raster_sha256": digest,
+                "format_version": STORE_FORMAT_VERSION,
+                "arrays": list(arrays),
+                "created": time.time(),
+            }
+            with open(tmp_dir / "meta.json", "w") as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(tmp_dir, entry)
+        except OSError as e:
+            # Another replica may have written the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not entry.exists():
+                log.error("Failed to save embeddings for %s/%s: %s", project, id, e)
+                return
+        self.stats["saved"] += 1
+
+        # Features of previous captures of this AOI will never be requested again
+        for stale in id_dir.iterdir():
+            if stale != entry and stale.name.startswith(f"{model_id}-") and stale.is_dir():
+                shutil.rmtree(stale, ignore_errors=True)
+
+        self.evict()
+
+    def _entries(self):
+        for entry in self.root.glob("*/*/*"):
+            meta_path = entry / "meta.json"
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                yield meta_path.stat().st_mtime, size, entry
+            except FileNotFoundError:
+                continue
+
+    def evict(self):
+        """Deletes least-recently-used entries until the store fits its size budget."""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                self.stats["evicted"] += 1
+                log.info("Evicted embeddings %s", entry)
+        finally:
+            self._evict_lock.release()
+
+    def metrics(self) -> dict:
+        return {**self.stats, "enabled": EMBEDDING_STORE_ENABLED, "max_bytes": self.max_bytes}
+
+
+embedding_store = EmbeddingStore()
+
+
+def _read_rgb(tif_file_path: str) -> np.ndarray:
+    """Reads the AOI raster as an HxWx3 uint8 array, as SamGeo2.set_image does."""
+    with rasterio.open(tif_file_path) as src:
+        return np.ascontiguousarray(np.transpose(src.read([1, 2, 3]), (1, 2, 0)))
+
+
+def _storage_dtype(tensor: torch.Tensor) -> torch.dtype:
+    """Returns the dtype a feature tensor is stored in."""
+    if embedding_store.dtype is not None:
+        return getattr(torch, embedding_store.dtype.name)
+    # numpy has no bfloat16; float32 holds every bfloat16 value exactly
+    return torch.float32 if tensor.dtype == torch.bfloat16 else tensor.dtype
+
+
+def set_image_cached(
+    samgeo_model, tif_file_path: str, model_id: str, project: str, id: str
+) -> Tuple[str, Optional[Callable[[], None]]]:
+    """
+    Sets the AOI image on a SamGeo2 predictor, reusing stored features when possible.
+
+    The image encoder only runs when neither the predictor itself (warm) nor the
+    embedding store has features for this model and raster. Freshly computed
+    features are copied to host memory here, but queueing them for the store is
+    left to the caller, to do once it no longer holds the model lock: a full
+    write-behind queue would otherwise stall every request on the model.
+
+    Args:
+        samgeo_model (SamGeo2): Predictor-mode SamGeo2 instance.
+        tif_file_path (str): Path to the AOI GeoTIFF.
+        model_id (str): SAM2 model identifier, e.g. "sam2-hiera-large".
+        project (str): Project ID.
+        id (str): AOI ID.
+
+    Returns:
+        tuple: "warm", "store" or "computed", depending on where the features came
+        from, and a callable queueing computed features for the store, or None.
+    """
+    digest = raster_digest(tif_file_path)
+    key = (model_id, digest)
+    if getattr(samgeo_model, "_embedding_key", None) == key:
+        embedding_store.stats["warm"] += 1
+        return "warm", None
+
+    predictor = samgeo_model.predictor
+    entry = None
+    if EMBEDDING_STORE_ENABLED:
+        entry = embedding_store.load(project, id, model_id, digest)
+    if entry is not None:
+        embedding_store.stats["hits"] += 1
+        # Restored to the dtype the encoder produced; on the CPU, without a cast,
+        # the tensors share memory with the mapped files
+        dtypes = entry["meta"]["dtypes"]
+        tensors = {
+            name: torch.from_numpy(array).to(
+                predictor.device, dtype=getattr(torch, dtypes[name].split(".")[-1])
+            )
+            for name, array in entry["arrays"].items()
+        }
+        high_res_names = sorted(n for n in tensors if n.startswith("high_res_feats_"))
+        predictor.reset_predictor()
+        predictor._features = {
+            "image_embed": tensors["image_embed"],
+            "high_res_feats": [tensors[name] for name in high_res_names],
+        }
+        predictor._orig_hw = [tuple(entry["meta"]["orig_hw"])]
+        predictor._is_batch = False
+        predictor._is_image_set = True
+        samgeo_model.source = tif_file_path
+        samgeo_model.image = _read_rgb(tif_file_path)
+        samgeo_model._embedding_key = key
+        return "store", None
+
+    embedding_store.stats["misses"] += 1
+    samgeo_model._embedding_key = None
+    samgeo_model.set_image(tif_file_path)
+    samgeo_model._embedding_key = key
+
+    persist = None
+    if EMBEDDING_STORE_ENABLED:
+        features = predictor._features
+        arrays = {"image_embed": features["image_embed"]}
+        for index, feat in enumerate(features["high_res_feats"]):
+            arrays[f"high_res_feats_{index}"] = feat
+        meta = {
+            "orig_hw": list(predictor._orig_hw[0]),
+            "dtypes": {name: str(t.dtype) for name, t in arrays.items()},
+        }
+        # Cast to the storage dtype on the device, so queued host copies are as small as on disk
+        arrays = {
+            name: t.detach().to(_storage_dtype(t)).cpu().numpy() for name, t in arrays.items()
+        }
+        # Persisted off the request path; the arrays are already copied to host memory
+        persist = partial(
+            write_behind.submit, embedding_store.save, project, id, model_id, digest, arrays, meta
+        )
+    return "computed", persist
@@ -0,0 +1,247 @@
+import os
+import json
+import hashlib
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio import features
+from rasterio.transform import array_bounds
+from rasterio.windows import Window, bounds as window_bounds
+from rasterio.warp import transform_bounds
+from shapely.geometry import box, mapping
+from utils.logger_config import log
+from utils.spatial_store import FEATURES_LAYER, FOOTPRINTS_LAYER, spatial_store
+
+INCREMENTAL_AUTOMATIC = os.getenv("INCREMENTAL_AUTOMATIC", "true").lower() == "true"
+# Below this share of already segmented pixels the whole AOI is processed again
+INCREMENTAL_MIN_REUSE = float(os.getenv("INCREMENTAL_MIN_REUSE", "0.25"))
+# Pixels of already segmented imagery added around new windows, for context at the seam
+INCREMENTAL_CONTEXT_PX = int(os.getenv("INCREMENTAL_CONTEXT_PX", "64"))
+# Share of uncovered pixels tolerated inside the covered block before falling back to one window
+MAX_UNCOVERED_INSIDE = 0.02
+
+
+def settings_key(
+    model_id: str,
+    quality: str,
+    cleanup: Optional[dict],
+    simplify_tolerance: float = 0,
+    area_val: float = 0,
+) -> str:
+    """
+    Identifies the settings whose results can be reused for one another. Stored
+    features are already simplified and area filtered, so those parameters are
+    part of the key too.
+    """
+    settings = json.dumps(
+        {
+            "model_id": model_id,
+            "quality": quality,
+            "cleanup": cleanup,
+            "simplify_tolerance": simplify_tolerance,
+            "area_val": area_val,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+
+
+def footprint_feature(tif_file_path: str, settings: str) -> dict:
+    """Returns the extent of an AOI raster as a GeoJSON footprint in EPSG:4326."""
+    with rasterio.open(tif_file_path) as src:
+        bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    return {"geometry": mapping(box(*bounds)), "properties": {"settings": settings}}
+
+
+class IncrementalPlan:
+    """
+    What an automatic run over an AOI can reuse from earlier runs of the project.
+
+    Attributes:
+        reuse_ratio (float): Share of the AOI pixels already segmented.
+        reused (gpd.GeoDataFrame): Earlier features whose representative point lies
+            in the AOI, in the raster CRS.
+        windows (list): Padded raster windows to segment, with their unpadded cores.
+        seam (shapely geometry): Edges of the earlier footprints inside the AOI,
+            where earlier features may have been cut by the raster border.
+        transform (Affine): Transform of the AOI raster.
+    """
+
+    def __init__(self, reuse_ratio, reused, windows, seam, transform, pixels):
+        self.reuse_ratio = reuse_ratio
+        self.reused = reused
+        self.windows = windows
+        self.seam = seam
+        self.transform = transform
+        self.pixels = pixels
+
+    @property
+    def processed_ratio(self) -> float:
+        """Share of the AOI pixels the generator runs on, padding included."""
+        area = sum(window.width * window.height for window, _ in self.windows)
+        return min(1.0, area / self.pixels)
+
+
+def _uncovered_windows(covered: np.ndarray) -> List[Window]:
+    """
+    Splits the uncovered part of the raster into up to four strips around the
+    covered block, e.g. one strip when the map was panned along one axis and two
+    when it moved diagonally. Falls back to the bounding box of the uncovered
+    pixels when the covered block itself has gaps.
+    """
+    height, width = covered.shape
+    rows = np.flatnonzero(covered.any(axis=1))
+    cols = np.flatnonzero(covered.any(axis=0))
+    top, bottom = int(rows[0]), int(rows[-1] + 1)
+    left, right = int(cols[0]), int(cols[-1] + 1)
+
+    if (~covered[top:bottom, left:right]).mean() > MAX_UNCOVERED_INSIDE:
+        rows = np.flatnonzero((~covered).any(axis=1))
+        cols = np.flatnonzero((~covered).any(axis=0))
+        return [Window(int(cols[0]), int(rows[0]), int(cols[-1] + 1 - cols[0]), int(rows[-1] + 1 - rows[0]))]
+
+    strips = [
+        Window(0, 0, width, top),
+        Window(0, bottom, width, height - bottom),
+        Window(0, top, left, bottom - top),
+        Window(right, top, width - right, bottom - top),
+    ]
+    return [strip for strip in strips if strip.width > 0 and strip.height > 0]
+
+
+def _pad(window: Window, pad: int, height: int, width: int) -> Window:
+    col_off = max(0, window.col_off - pad)
+    row_off = max(0, window.row_off - pad)
+    col_end = min(width, window.col_off + window.width + pad)
+    row_end = min(height, window.row_off + window.height + pad)
+    return Window(int(col_off), int(row_off), int(col_end - col_off), int(row_end - row_off))
+
+
+def _deduplicate(reused: gpd.GeoDataFrame, min_iou: float = 0.5) -> gpd.GeoDataFrame:
+    """Keeps the newest of reused features that overlap, e.g. an object re-segmented at a seam."""
+    pairs = gpd.sjoin(reused[["geometry"]], reused[["geometry"]], predicate="intersects")
+    pairs = pairs[pairs.index != pairs["index_right"]]
+    if pairs.empty:
+        return reused
+    left = reused.geometry.loc[pairs.index].values
+    right = reused.geometry.loc[pairs["index_right"]].values
+    iou = left.intersection(right).area / left.union(right).area
+    created = reused["created"]
+    left_created = created.loc[pairs.index].values
+    right_created = created.loc[pairs["index_right"]].values
+    older = (left_created < right_created) | (
+        (left_created == right_created) & (pairs.index.values > pairs["index_right"].values)
+    )
+    return reused.drop(index=np.unique(pairs.index.values[(iou > min_iou) & older]))
+
+
+def plan_incremental(project: str, zoom: int, tif_file_path: str, settings: str) -> Optional[IncrementalPlan]:
+    """
+    Looks up earlier automatic runs overlapping an AOI through the footprints
+    layer of the project store (an R-tree query) and plans which part of the
+    raster still has to be segmented.
+
+    Only runs at the same zoom and with the same settings (model, quality tier,
+    mask cleanup, simplification and area filter) are reused, and only their
+    features whose representative point lies in the AOI.
+
+    Returns:
+        IncrementalPlan: The plan, or None when too little can be reused.
+    """
+    with rasterio.open(tif_file_path) as src:
+        transform, crs = src.transform, src.crs
+        height, width = src.height, src.width
+        aoi_bounds = transform_bounds(crs, "EPSG:4326", *src.bounds)
+
+    footprints = [
+        footprint
+        for footprint in spatial_store.query(project, bbox=aoi_bounds, layer=FOOTPRINTS_LAYER)
+        if footprint["properties"]["zoom"] == zoom
+        and footprint["properties"]["settings"] == settings
+    ]
+    if not footprints:
+        return None
+
+    footprints = gpd.GeoDataFrame.from_features(footprints, crs="EPSG:4326").to_crs(crs)
+    covered = features.geometry_mask(
+        footprints.geometry, out_shape=(height, width), transform=transform, invert=True
+    )
+    reuse_ratio = float(covered.mean())
+    if reuse_ratio < INCREMENTAL_MIN_REUSE:
+        log.info("Only %.0f%% of %s AOI segmented before, processing it whole", reuse_ratio * 100, project)
+        return None
+
+    aoi = box(*array_bounds(height, width, transform))
+    geojson_files = set(footprints["geojson_file"])
+    reused = [
+        feature
+        for feature in spatial_store.query(project, bbox=aoi_bounds, layer=FEATURES_LAYER)
+        if feature["properties"]["source"] == "automatic"
+        and feature["properties"]["geojson_file"] in geojson_files
+    ]
+    if reused:
+        reused = gpd.GeoDataFrame.from_features(reused, crs="EPSG:4326").to_crs(crs)
+        # The R-tree query matches bounding boxes; keep only the features of this AOI,
+        # with the same rule as the new features of a window
+        reused = reused[reused.geometry.representative_point().within(aoi)]
+        reused = _deduplicate(reused.reset_index(drop=True))
+    else:
+        reused = gpd.GeoDataFrame({"value": []}, geometry=[], crs=crs)
+
+    windows = []
+    if not covered.all():
+        for core in _uncovered_windows(covered):
+            windows.append((_pad(core, INCREMENTAL_CONTEXT_PX, height, width), core))
+
+    seam = footprints.unary_union.boundary.intersection(aoi).buffer(2 * abs(transform.a))
+    return IncrementalPlan(reuse_ratio, reused, windows, seam, transform, height * width)
+
+
+def write_window(tif_file_path: str, window: Window, output: str):
+    """Writes a window of the AOI raster as its own GeoTIFF."""
+    with rasterio.open(tif_file_path) as src:
+        profile = src.profile
+        profile.update(
+            width=window.width, height=window.height, transform=src.window_transform(window)
+        )
+        data = src.read(window=window)
+    with rasterio.open(output, "w", **profile) as dst:
+        dst.write(data)
+
+
+def merge_results(plan: IncrementalPlan, window_gdfs: List[gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
+    """
+    Merges the features segmented in the new windows with the reused ones.
+
+    A new feature is kept when its representative point lies in the unpadded core
+    of its window, so the padding only adds context. Reused features crossing the
+    seam of an earlier footprint were likely cut by the earlier raster border, and
+    are replaced by the new features they intersect.
+
+    Returns:
+        gpd.GeoDataFrame: Reused and new features, with a boolean "reused" column.
+    """
+    crs = plan.reused.crs
+    kept = []
+    for (_, core), gdf in zip(plan.windows, window_gdfs):
+        if gdf.empty:
+            continue
+        core_box = box(*window_bounds(core, plan.transform))
+        kept.append(gdf[gdf.geometry.representative_point().within(core_box)])
+    new = (
+        gpd.GeoDataFrame(pd.concat(kept, ignore_index=True), crs=crs)
+        if kept
+        else gpd.GeoDataFrame({"value": []}, geometry=[], crs=crs)
+    )
+
+    reused = plan.reused
+    if not new.empty and not reused.empty:
+        at_seam = reused[reused.intersects(plan.seam)]
+        replaced = gpd.sjoin(at_seam[["geometry"]], new[["geometry"]], predicate="intersects")
+        reused = reused.drop(index=replaced.index.unique())
+
+    reused = reused[["value", "geometry"]].assign(reused=True)
+    new = new[["value", "geometry"]].assign(reused=False)
+    return gpd.GeoDataFrame(pd.concat([reused, new], ignore_index=True), crs=crs)
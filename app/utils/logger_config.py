@@ -1,8 +1,201 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one structured record per line, "text" for the classic human-readable lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Longer messages and extra fields are truncated, so a large payload never reaches the output whole
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+# INFO and DEBUG records allowed per second from one call site; 0 disables the limit
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+# Records waiting for the writer thread; when full, INFO and DEBUG records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# One record per request, never rate limited
+ACCESS_LOGGER = "access"
+
+# Correlation id of the request being served; copied into worker threads with the context
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _truncate(value, limit: int = LOG_MAX_FIELD_CHARS):
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} chars truncated]"
+    return text
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id, on the thread that logs them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (file and line) for INFO and DEBUG records.
+
+    Warnings and errors always pass, as do records of the `exempt` loggers (the
+    access log, one call site that logs every request). The number of records
+    suppressed at a call site is attached to the next record that passes there.
+    """
+
+    def __init__(self, rate: float, burst: float = None, exempt: tuple = ()):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.exempt = set(exempt)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING or record.name in self.exempt:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[site] = (tokens, now, suppressed + 1)
+                self.suppressed += 1
+                return False
+            self._buckets[site] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread without formatting them.
+
+    The message is only merged with its arguments on the writer thread, so
+    arguments must not be mutated after logging them. A full queue drops INFO
+    and DEBUG records (counted in `dropped`) instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks reference frames that may be gone by the time the writer runs
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """A QueueListener whose `stop` waits for room in a full queue instead of raising."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object, extra fields included."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name or "root",
+            "msg": _truncate(record.getMessage()),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName,
+            "process": record.processName,
+            "src": f"{record.module}:{record.lineno}",
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = _truncate(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(
+            "%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+        )
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _truncate(record.message)
+        return super().formatMessage(record)
+
+
+def configure_logging(stream=None):
+    """
+    Routes the root logger through a queue to a single writer thread.
+
+    Callers only stamp the record and enqueue it; formatting and the write to
+    the stream happen on the listener thread.
+
+    Args:
+        stream: Where records are written, stderr by default.
+
+    Returns:
+        tuple: The queue handler and the started listener, stopped (and drained) at exit.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream = logging.StreamHandler(stream or sys.stderr)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    # Rate limit first, so suppressed records are not stamped for nothing
+    handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, exempt=(ACCESS_LOGGER,)))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    listener = DrainingQueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler, listener
+
+
+log_handler, log_listener = configure_logging()
 log = logging.getLogger("")
+access_log = logging.getLogger(ACCESS_LOGGER)
+
+
+def log_metrics() -> dict:
+    """Queue depth, records dropped because the queue was full and records rate limited."""
+    rate_limit = next(f for f in log_handler.filters if isinstance(f, RateLimitFilter))
+    return {
+        "queued": log_handler.queue.qsize(),
+        "dropped": log_handler.dropped,
+        "rate_limited": rate_limit.suppressed,
+    }
@@ -0,0 +1,194 @@
+import numpy as np
+from scipy import ndimage
+
+# Regions are 4-connected, like the polygons produced by rasterio.features.shapes
+CONNECTIVITY = ndimage.generate_binary_structure(2, 1)
+
+
+def _disk(radius: int) -> np.ndarray:
+    y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    return x * x + y * y <= radius * radius
+
+
+def _planar(structure: np.ndarray) -> np.ndarray:
+    """Lifts a 2D structuring element to a mask stack, without linking masks."""
+    planar = np.zeros((3,) + structure.shape, dtype=bool)
+    planar[1] = structure
+    return planar
+
+
+def _small_holes(background: np.ndarray, max_hole_px: int, structure: np.ndarray):
+    """
+    Labels the background regions up to `max_hole_px` pixels that do not touch
+    the raster border, in one labelling pass.
+
+    Returns:
+        tuple: The background region labels and a boolean lookup of the small holes.
+    """
+    regions, n_regions = ndimage.label(background, structure=structure)
+    small = np.bincount(regions.ravel(), minlength=n_regions + 1) <= max_hole_px
+    small[0] = False
+    border = [regions[..., 0, :], regions[..., -1, :], regions[..., :, 0], regions[..., :, -1]]
+    small[np.unique(np.concatenate([edge.ravel() for edge in border]))] = False
+    return regions, small
+
+
+def clean_mask_stack(
+    masks: np.ndarray,
+    open_px: int = 0,
+    close_px: int = 0,
+    max_hole_px: int = 0,
+    min_area_px: int = 0,
+    smooth_sigma: float = 0.0,
+) -> np.ndarray:
+    """
+    Cleans a batch of binary masks before vectorization.
+
+    Every step runs once over the whole stack, with structuring elements that
+    never connect one mask to the next.
+
+    Args:
+        masks (np.ndarray): Boolean masks, shape (N, H, W) or (H, W).
+        open_px (int): Radius of the opening that removes speckles and thin spurs.
+        close_px (int): Radius of the closing that bridges small cracks.
+        max_hole_px (int): Holes up to this area in pixels are filled.
+        min_area_px (int): Connected regions smaller than this area in pixels are removed.
+        smooth_sigma (float): Gaussian sigma in pixels used to smooth staircase edges.
+
+    Returns:
+        np.ndarray: The cleaned boolean masks, in the input shape.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    single = masks.ndim == 2
+    if single:
+        masks = masks[np.newaxis]
+
+    # Replicate the edges so regions touching the raster border are not eroded there
+    pad = max(open_px, close_px, int(np.ceil(3 * smooth_sigma)))
+    if pad:
+        masks = np.pad(masks, ((0, 0), (pad, pad), (pad, pad)), mode="edge")
+    if open_px:
+        masks = ndimage.binary_opening(masks, structure=_planar(_disk(open_px)))
+    if close_px:
+        masks = ndimage.binary_closing(masks, structure=_planar(_disk(close_px)))
+    if smooth_sigma:
+        smoothed = ndimage.gaussian_filter(
+            masks.astype(np.float32), sigma=(0, smooth_sigma, smooth_sigma)
+        )
+        masks = smoothed >= 0.5
+    if pad:
+        masks = masks[:, pad:-pad, pad:-pad]
+
+    structure = _planar(CONNECTIVITY)
+    if max_hole_px:
+        regions, small = _small_holes(~masks, max_hole_px, structure)
+        masks = masks | small[regions]
+    if min_area_px:
+        labels, _ = ndimage.label(masks, structure=structure)
+        keep = np.bincount(labels.ravel()) >= min_area_px
+        keep[0] = False
+        masks = keep[labels]
+
+    return masks[0] if single else masks
+
+
+def _same_label_components(labels: np.ndarray) -> np.ndarray:
+    """
+    Labels the 4-connected regions of equal non-zero value in a label raster.
+
+    The raster is upsampled 2x and the sub-pixels between neighbours with
+    different values are cleared, so a single binary labelling separates
+    touching masks. The top-left sub-pixel of every pixel is never cleared.
+    """
+    up = np.repeat(np.repeat(labels, 2, axis=0), 2, axis=1)
+    cut_right = labels[:, :-1] != labels[:, 1:]
+    cut_down = labels[:-1, :] != labels[1:, :]
+    up[:, 1:-1:2][np.repeat(cut_right, 2, axis=0)] = 0
+    up[1:-1:2, :][np.repeat(cut_down, 2, axis=1)] = 0
+    components, _ = ndimage.label(up != 0, structure=CONNECTIVITY)
+    return components[::2, ::2]
+
+
+def clean_label_mask(
+    labels: np.ndarray,
+    open_px: int = 0,
+    close_px: int = 0,
+    max_hole_px: int = 0,
+    min_area_px: int = 0,
+    smooth_sigma: float = 0.0,
+) -> np.ndarray:
+    """
+    Cleans a label raster, where each non-zero value is one mask (the output of
+    automatic segmentation), with the same steps as `clean_mask_stack`.
+
+    All masks are processed at once with min/max filters over the whole raster
+    instead of one binary image per mask. Opening and area filtering are exact
+    per mask. Closing and hole filling only turn background pixels into a mask
+    when a single mask surrounds them, and smoothing gives new pixels the value
+    of the nearest mask, so touching masks are never merged.
+
+    Args:
+        labels (np.ndarray): Integer label raster, shape (H, W).
+
+    Returns:
+        np.ndarray: The cleaned label raster, with the input dtype.
+    """
+    dtype = labels.dtype
+    labels = labels.astype(np.int32)
+    background = np.iinfo(np.int32).max
+
+    if open_px:
+        # A pixel survives erosion when its whole neighbourhood has its value; the
+        # dilation of the survivors can only reach pixels of that same value
+        footprint = _disk(open_px)
+        lowest = ndimage.minimum_filter(labels, footprint=footprint, mode="nearest")
+        highest = ndimage.maximum_filter(labels, footprint=footprint, mode="nearest")
+        eroded = np.where((lowest == highest) & (labels != 0), labels, 0)
+        opened = ndimage.maximum_filter(eroded, footprint=footprint, mode="nearest")
+        labels = np.where(opened == labels, labels, 0)
+
+    if close_px:
+        # Dilate into background that only one mask reaches, then erode
+        footprint = _disk(close_px)
+        highest = ndimage.maximum_filter(labels, footprint=footprint, mode="nearest")
+        lowest = ndimage.minimum_filter(
+            np.where(labels != 0, labels, background), footprint=footprint, mode="nearest"
+        )
+        dilated = np.where(labels != 0, labels, np.where(highest == lowest, highest, 0))
+        lowest = ndimage.minimum_filter(dilated, footprint=footprint, mode="nearest")
+        highest = ndimage.maximum_filter(dilated, footprint=footprint, mode="nearest")
+        closed = (lowest == highest) & (dilated != 0)
+        labels = np.where((labels == 0) & closed, dilated, labels)
+
+    if max_hole_px:
+        regions, small = _small_holes(labels == 0, max_hole_px, CONNECTIVITY)
+        if small.any():
+            highest = ndimage.maximum_filter(labels, size=3, mode="nearest")
+            lowest = ndimage.minimum_filter(
+                np.where(labels != 0, labels, background), size=3, mode="nearest"
+            )
+            # Holes are filled with the surrounding value when one mask encloses them
+            in_hole = small[regions]
+            hole_ids = regions[in_hole]
+            outer_max = np.zeros(small.size, dtype=labels.dtype)
+            outer_min = np.full(small.size, background, dtype=labels.dtype)
+            np.maximum.at(outer_max, hole_ids, highest[in_hole])
+            np.minimum.at(outer_min, hole_ids, lowest[in_hole])
+            fill = np.where(small & (outer_max == outer_min), outer_max, 0)
+            labels = np.where(in_hole, fill[regions], labels)
+
+    if smooth_sigma:
+        # Smooth the foreground outline; pixels keep or take the nearest mask value
+        smoothed = ndimage.gaussian_filter((labels != 0).astype(np.float32), smooth_sigma, mode="nearest")
+        nearest = ndimage.distance_transform_edt(
+            labels == 0, return_distances=False, return_indices=True
+        )
+        labels = np.where(smoothed >= 0.5, labels[tuple(nearest)], 0)
+
+    if min_area_px:
+        components = _same_label_components(labels)
+        keep = np.bincount(components.ravel()) >= min_area_px
+        keep[0] = False
+        labels = np.where(keep[components], labels, 0)
+
+    return labels.astype(dtype)
@@ -0,0 +1,210 @@
+import os
+import gc
+import time
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional, Tuple
+import torch
+from utils.logger_config import log
+
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "8192"))
+DEFAULT_AUTOMATIC_MODEL = os.getenv("DEFAULT_AUTOMATIC_MODEL", "sam2-hiera-large")
+DEFAULT_PREDICTOR_MODEL = os.getenv("DEFAULT_PREDICTOR_MODEL", "sam2-hiera-large")
+EWMA_ALPHA = 0.2
+
+# Approximate parameter counts, used to budget memory before a model is loaded
+SAM2_MODELS = {
+    "sam2-hiera-tiny": 38.9e6,
+    "sam2-hiera-small": 46.0e6,
+    "sam2-hiera-base-plus": 80.8e6,
+    "sam2-hiera-large": 224.4e6,
+}
+
+
+def module_bytes(module) -> int:
+    """Returns the memory held by the parameters and buffers of a torch module."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelEntry:
+    """A loaded SamGeo2 instance and its usage statistics."""
+
+    def __init__(self, model_id: str, automatic: bool, model, memory_bytes: int, load_s: float):
+        self.model_id = model_id
+        self.automatic = automatic
+        self.model = model
+        self.memory_bytes = memory_bytes
+        self.load_s = load_s
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+        # SamGeo2 keeps per-call state (image, masks), so each instance runs one request at a time
+        self.lock = threading.Lock()
+        self.leases = 0
+        self.requests = 0
+        self.latency_s: Optional[float] = None
+        # Extra objects built on top of the model, e.g. mask generators per quality tier
+        self.extras: Dict[str, object] = {}
+
+    def record(self, elapsed: float):
+        self.requests += 1
+        if self.latency_s is None:
+            self.latency_s = elapsed
+        else:
+            self.latency_s += EWMA_ALPHA * (elapsed - self.latency_s)
+
+
+class ModelRegistry:
+    """
+    Loads SAM2 variants on demand and keeps them under a total memory budget.
+
+    Models are keyed by model ID and mode (automatic or predictor). When loading a
+    model would exceed the budget, the least recently used models that are not
+    serving a request are unloaded first.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, bool], object],
+        budget_bytes: int = MODEL_MEMORY_BUDGET_MB * 1024**2,
+    ):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self._entries: Dict[Tuple[str, bool], ModelEntry] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, bool], threading.Lock] = {}
+        self.stats = {"loads": 0, "unloads": 0}
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.memory_bytes for entry in self._entries.values())
+
+    def _make_room(self, incoming_bytes: int):
+        """Unloads idle models, least recently used first. Called with `_lock` held."""
+        idle = sorted(
+            (entry for entry in self._entries.values() if entry.leases == 0),
+            key=lambda entry: entry.last_used,
+        )
+        for entry in idle:
+            if self._resident_bytes() + incoming_bytes <= self.budget_bytes:
+                break
+            log.info("Unloading %s (automatic=%s) to free memory", entry.model_id, entry.automatic)
+            del self._entries[(entry.model_id, entry.automatic)]
+            self.stats["unloads"] += 1
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _load(self, key: Tuple[str, bool]) -> ModelEntry:
+        model_id, automatic = key
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same model wait for a single load
+        with load_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+                estimate = int(SAM2_MODELS[model_id] * 4 * 1.2)
+                if self._resident_bytes() + estimate > self.budget_bytes:
+                    self._make_room(estimate)
+
+            log.info("Loading %s (automatic=%s)", model_id, automatic)
+            start = time.monotonic()
+            model = self.loader(model_id, automatic)
+            load_s = time.monotonic() - start
+            predictor = model.mask_generator.predictor if automatic else model.predictor
+            entry = ModelEntry(model_id, automatic, model, module_bytes(predictor.model), load_s)
+
+            with self._lock:
+                self._entries[key] = entry
+                self.stats["loads"] += 1
+                if self._resident_bytes() > self.budget_bytes:
+                    log.warning(
+                        "Resident models use %.0f MB, over the %.0f MB budget",
+                        self._resident_bytes() / 1024**2,
+                        self.budget_bytes / 1024**2,
+                    )
+            return entry
+
+    @contextlib.contextmanager
+    def use(self, model_id: Optional[str], automatic: bool):
+        """
+        Leases a model for the duration of a request, loading it if needed.
+
+        The entry is protected from unloading while leased, and its lock is held
+        until the block exits, so one request at a time uses the model. The recorded
+        latency only covers the block, not the wait for a load or for the lock.
+
+        Args:
+            model_id (str): SAM2 model ID, or None for the mode's default.
+            automatic (bool): Whether the automatic mask generator is needed.
+
+        Yields:
+            ModelEntry: The loaded model entry.
+        """
+        if model_id is None:
+            model_id = DEFAULT_AUTOMATIC_MODEL if automatic else DEFAULT_PREDICTOR_MODEL
+        if model_id not in SAM2_MODELS:
+            raise ValueError(f"Unknown model '{model_id}', expected one of {list(SAM2_MODELS)}")
+
+        key = (model_id, automatic)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.leases += 1
+                    break
+            self._load(key)
+
+        elapsed = None
+        try:
+            with entry.lock:
+                start = time.monotonic()
+                try:
+                    yield entry
+                finally:
+                    elapsed = time.monotonic() - start
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+                if elapsed is not None:
+                    entry.record(elapsed)
+
+    def preload(self, keys: List[Tuple[str, bool]]):
+        """
+        Loads models ahead of their first request, e.g. at startup, so that request
+        does not pay for the build and weight download.
+
+        Args:
+            keys (list): (model ID, automatic) pairs to load.
+        """
+        for key in keys:
+            try:
+                self._load(key)
+            except Exception as e:
+                log.error("Could not preload %s (automatic=%s): %s", key[0], key[1], e)
+
+    def metrics(self) -> dict:
+        """Returns residency and latency per model."""
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "budget_mb": round(self.budget_bytes / 1024**2),
+            "resident_mb": round(sum(e.memory_bytes for e in entries) / 1024**2),
+            **self.stats,
+            "available": list(SAM2_MODELS),
+            "resident": [
+                {
+                    "model_id": entry.model_id,
+                    "mode": "automatic" if entry.automatic else "predictor",
+                    "memory_mb": round(entry.memory_bytes / 1024**2),
+                    "load_s": round(entry.load_s, 3),
+                    "in_use": entry.leases,
+                    "requests": entry.requests,
+                    "latency_s": round(entry.latency_s, 3) if entry.latency_s else None,
+                    "idle_s": round(time.monotonic() - entry.last_used, 1),
+                }
+                for entry in entries
+            ],
+        }
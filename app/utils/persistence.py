@@ -0,0 +1,258 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import mimetypes
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from utils.logger_config import log
+
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "64"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "true").lower() == "true"
+# Items waiting for the writer; when full, producers wait for room (backpressure)
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "128"))
+# Attempts after the first failure of a write-behind job, with exponential backoff
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "5"))
+
+
+def retry(fn: Callable, *args, retries: int = WRITE_BEHIND_RETRIES, backoff_s: float = 0.5, **kwargs):
+    """
+    Calls `fn(*args, **kwargs)`, retrying with exponential backoff when it raises,
+    e.g. while another process holds a SQLite lock on a project store. Meant for
+    work on the writer thread, which is off the request path and can wait.
+
+    Returns:
+        The result of `fn`; the last error is raised once the retries are exhausted.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff_s * 2**attempt
+            log.warning(
+                "%s failed (%s), retrying in %.1fs", getattr(fn, "__name__", fn), e, delay
+            )
+            time.sleep(delay)
+
+
+class PendingFile:
+    """A file waiting to be written. Its content is rendered once, on first need."""
+
+    def __init__(self, path: str, render: Callable[[], bytes]):
+        self.path = path
+        self._render = render
+        self._content: Optional[bytes] = None
+        self._lock = threading.Lock()
+
+    def content(self) -> bytes:
+        with self._lock:
+            if self._content is None:
+                self._content = self._render()
+                self._render = None
+            return self._content
+
+
+class WriteBehindQueue:
+    """
+    Persists segmentation artifacts on a background thread.
+
+    Request handlers enqueue files and store appends and return immediately. The
+    writer drains the queue in batches, merging spatial store appends per project,
+    and files not yet on disk are served from memory through `read_pending`.
+    `flush` blocks until everything is on disk, e.g. at shutdown.
+
+    The queue is bounded, so a slow disk slows producers down instead of growing
+    memory without limit.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+        max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+    ):
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._pending: Dict[str, PendingFile] = {}
+        self._pending_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"files": 0, "jobs": 0, "batches": 0, "errors": 0, "backpressure": 0}
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def write_file(self, path: str, render: Callable[[], bytes]):
+        """
+        Schedules a file write.
+
+        Args:
+            path (str): Destination path.
+            render (Callable): Returns the file content as bytes. It runs on the writer
+                thread, or on the first reader if the file is requested before then.
+        """
+        self._put(("file", self._add_pending(path, render)))
+
+    async def write_file_async(self, path: str, render: Callable[[], bytes]):
+        """
+        Schedules a file write from an async handler. When the queue is full, the
+        wait for room runs in a thread, so it slows this request down instead of
+        blocking the event loop.
+        """
+        item = ("file", self._add_pending(path, render))
+        if not self._offer(item):
+            self.stats["backpressure"] += 1
+            await asyncio.to_thread(self._queue.put, item)
+
+    def _add_pending(self, path: str, render: Callable[[], bytes]) -> PendingFile:
+        pending = PendingFile(os.path.abspath(path), render)
+        with self._pending_lock:
+            self._pending[pending.path] = pending
+        return pending
+
+    def _forget(self, pending: PendingFile):
+        with self._pending_lock:
+            # A newer write of the same path keeps serving from memory until it lands
+            if self._pending.get(pending.path) is pending:
+                del self._pending[pending.path]
+
+    def submit(self, fn: Callable, *args, group: Optional[str] = None, **kwargs):
+        """
+        Schedules an arbitrary persistence job.
+
+        Without a `group`, the writer calls `fn(*args, **kwargs)`. Jobs with the same
+        `fn` and `group` (e.g. spatial store appends for one project) that land in the
+        same batch are merged: `fn` is called once with the list of their (args, kwargs).
+        """
+        self._put(("job", (fn, args, kwargs, group)))
+
+    def _offer(self, item: tuple) -> bool:
+        """Queues an item without waiting, returning False when the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if threading.current_thread() is not self._thread:
+                return False
+            # A job scheduling more work would otherwise wait for itself
+            self._process([item])
+        return True
+
+    def _put(self, item: tuple):
+        """Queues an item, waiting for room when the queue is full. Not for the event loop."""
+        if not self._offer(item):
+            self.stats["backpressure"] += 1
+            self._queue.put(item)
+
+    def read_pending(self, path: str) -> Optional[bytes]:
+        """Returns the content of a file that is scheduled but not yet written."""
+        with self._pending_lock:
+            pending = self._pending.get(os.path.abspath(path))
+        return pending.content() if pending else None
+
+    def _write(self, pending: PendingFile):
+        tmp_path = f"{pending.path}.tmp-{threading.get_ident()}"
+        os.makedirs(os.path.dirname(pending.path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(pending.content())
+                if self.fsync:
+                    tmp_file.flush()
+                    os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, pending.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._forget(pending)
+        self.stats["files"] += 1
+
+    def _call(self, fn: Callable, *args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.error("Write-behind job %s failed: %s", getattr(fn, "__name__", fn), e)
+
+    def _run_jobs(self, jobs: List[tuple]):
+        grouped = defaultdict(list)
+        for fn, args, kwargs, group in jobs:
+            if group is None:
+                self._call(fn, *args, **kwargs)
+            else:
+                grouped[(fn, group)].append((args, kwargs))
+        # Grouped jobs take a list of (args, kwargs) and merge them into one write
+        for (fn, _), calls in grouped.items():
+            self._call(fn, calls)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.stats["batches"] += 1
+            try:
+                self._process(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _process(self, batch: List[tuple]):
+        jobs = []
+        for kind, item in batch:
+            if kind == "file":
+                try:
+                    retry(self._write, item)
+                except Exception as e:
+                    # Stop serving content that never reached the disk
+                    self._forget(item)
+                    self.stats["errors"] += 1
+                    log.error("Write-behind failed for %s: %s", item.path, e)
+            else:
+                jobs.append(item)
+        if jobs:
+            self.stats["jobs"] += len(jobs)
+            self._run_jobs(jobs)
+
+    def flush(self):
+        """Blocks until every scheduled write has been persisted."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def metrics(self) -> dict:
+        with self._pending_lock:
+            pending_files = len(self._pending)
+        return {**self.stats, "queued": self._queue.qsize(), "pending_files": pending_files}
+
+
+write_behind = WriteBehindQueue()
+
+
+class WriteBehindStaticFiles(StaticFiles):
+    """Static files that also serve artifacts still waiting in the write-behind queue."""
+
+    async def get_response(self, path: str, scope):
+        full_path = os.path.join(self.directory, path)
+        # Rendering a pending file may encode a large payload, keep it off the event loop
+        content = await asyncio.to_thread(write_behind.read_pending, full_path)
+        if content is not None:
+            media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+            if full_path.endswith(".geojson"):
+                media_type = "application/geo+json"
+            return Response(content=content, media_type=media_type)
+        return await super().get_response(path, scope)
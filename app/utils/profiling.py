@@ -0,0 +1,201 @@
+import os
+import hmac
+import time
+import secrets
+import cProfile
+import threading
+import contextlib
+from pathlib import Path
+from typing import Callable, Optional
+from utils.logger_config import log
+
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
+
+# Profiling is off unless an admin enables it; the header alone cannot turn it on
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = int(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+# Outside the static root; traces are only served through the token-checked /profiles route
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join("data", "profiles"))
+PROFILE_HEADER = "X-Profile"
+
+_sample_counter = 0
+_sample_lock = threading.Lock()
+# Held while a call is profiled; concurrent sampled requests run unprofiled instead
+_profile_lock = threading.Lock()
+
+
+def token_accepted(header_value: Optional[str]) -> bool:
+    """Whether an `X-Profile` header value matches PROFILING_TOKEN, when one is configured."""
+    return not PROFILING_TOKEN or hmac.compare_digest(header_value or "", PROFILING_TOKEN)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Returns the path of a stored trace, or None for unknown names or names outside the directory."""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        return None
+    path = os.path.join(PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def should_profile(header_value: Optional[str]) -> bool:
+    """
+    Decides whether a request should be profiled.
+
+    A request is profiled when profiling is enabled and either it carries the
+    `X-Profile` header (matching PROFILING_TOKEN when one is configured), or it is
+    the N-th request under PROFILING_SAMPLE_RATE.
+
+    Args:
+        header_value (str): Value of the `X-Profile` request header, if any.
+
+    Returns:
+        bool: True if the request should be profiled.
+    """
+    global _sample_counter
+    if not PROFILING_ENABLED:
+        return False
+
+    if header_value and token_accepted(header_value):
+        return True
+
+    if PROFILING_SAMPLE_RATE > 0:
+        with _sample_lock:
+            _sample_counter += 1
+            return _sample_counter % PROFILING_SAMPLE_RATE == 0
+
+    return False
+
+
+def _prune_profiles(max_files: int):
+    """Keeps only the newest `max_files` traces in the profiling directory."""
+    files = sorted(Path(PROFILING_DIR).glob("*"), key=lambda f: f.stat().st_mtime, reverse=True)
+    for stale in files[max_files:]:
+        with contextlib.suppress(FileNotFoundError):
+            stale.unlink()
+
+
+def _python_profiler():
+    """Returns a sampling profiler if pyinstrument is installed, cProfile otherwise."""
+    try:
+        from pyinstrument import Profiler
+
+        return Profiler(interval=0.001), "html"
+    except ImportError:
+        return cProfile.Profile(), "prof"
+
+
+class ProfileSession:
+    """
+    Captures a Python and torch profile around a single function call.
+
+    Traces are written to PROFILING_DIR under unguessable names and served by
+    `/profiles/{name}`, which checks the same token as the `X-Profile` header.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.urls = []
+
+    def _output_path(self, suffix: str) -> str:
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        return os.path.join(
+            PROFILING_DIR,
+            f"{self.label}_{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_urlsafe(16)}.{suffix}",
+        )
+
+    def _add_file(self, path: str):
+        self.urls.append(f"{BASE_URL}/profiles/{os.path.basename(path)}")
+
+    def wrap(self, fn: Callable) -> Callable:
+        """
+        Returns `fn` wrapped so that its execution is profiled.
+
+        Args:
+            fn (Callable): The segmentation function to profile.
+
+        Returns:
+            Callable: A function with the same signature as `fn`.
+        """
+
+        def profiled(*args, **kwargs):
+            # cProfile and the torch profiler are process-wide: one profiled call at a time
+            if not _profile_lock.acquire(blocking=False):
+                log.info("Profiler busy, running %s unprofiled", self.label)
+                return fn(*args, **kwargs)
+            try:
+                profilers = self._start()
+            except Exception as e:
+                _profile_lock.release()
+                log.error("Could not start profiling %s, running unprofiled: %s", self.label, e)
+                return fn(*args, **kwargs)
+
+            started = time.monotonic()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - started
+                try:
+                    self._stop(*profilers)
+                    # The torch trace can only be exported once the profiler has stopped
+                    self._save(*profilers, elapsed)
+                except Exception as e:
+                    log.error("Could not finish profiling %s: %s", self.label, e)
+                finally:
+                    _profile_lock.release()
+
+        return profiled
+
+    def _start(self):
+        """Starts the torch and Python profilers; nothing is left running if either fails."""
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        py_profiler, py_format = _python_profiler()
+        torch_profiler = profile(activities=activities, record_shapes=True)
+        torch_profiler.start()
+        try:
+            if py_format == "prof":
+                py_profiler.enable()
+            else:
+                py_profiler.start()
+        except Exception:
+            torch_profiler.stop()
+            raise
+        return py_profiler, py_format, torch_profiler
+
+    def _stop(self, py_profiler, py_format: str, torch_profiler):
+        try:
+            if py_format == "prof":
+                py_profiler.disable()
+            else:
+                py_profiler.stop()
+        finally:
+            torch_profiler.stop()
+
+    def _save(self, py_profiler, py_format: str, torch_profiler, elapsed: float):
+        try:
+            py_path = self._output_path(py_format)
+            if py_format == "prof":
+                py_profiler.dump_stats(py_path)
+            else:
+                with open(py_path, "w") as html_file:
+                    html_file.write(py_profiler.output_html())
+            self._add_file(py_path)
+        except Exception as e:
+            log.error("Failed to save Python profile for %s: %s", self.label, e)
+
+        try:
+            trace_path = self._output_path("trace.json")
+            torch_profiler.export_chrome_trace(trace_path)
+            self._add_file(trace_path)
+        except Exception as e:
+            log.error("Failed to save torch trace for %s: %s", self.label, e)
+
+        log.info("Profiled %s in %.3fs: %s", self.label, elapsed, ", ".join(self.urls))
+        _prune_profiles(PROFILING_MAX_FILES)
@@ -0,0 +1,100 @@
+import os
+import gzip
+import json
+import asyncio
+from typing import Any, Optional
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is listed in requirements.txt
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "16384"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "1"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "1"))
+
+
+def json_default(obj):
+    """Serializes numpy scalars and other objects exposing `.item()` or `.tolist()`."""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serializes already-built GeoJSON (plain dicts, lists, tuples, numpy values) to bytes.
+
+    Uses orjson when available and falls back to the standard library.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, accept_encoding: str):
+    """
+    Compresses a response body with the best encoding accepted by the client.
+
+    Args:
+        body (bytes): Encoded JSON body.
+        accept_encoding (str): Value of the request `Accept-Encoding` header.
+
+    Returns:
+        tuple: The (possibly) compressed body and its `Content-Encoding`, or None.
+    """
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    accepted = {item.split(";")[0].strip() for item in accept_encoding.lower().split(",")}
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def encode_response_body(content: Any, accept_encoding: str = ""):
+    """Serializes and compresses a response body, returning it with its encoding."""
+    body = content if isinstance(content, bytes) else dumps(content)
+    return compress(body, accept_encoding)
+
+
+async def geojson_response(
+    content: Any,
+    request: Optional[Request] = None,
+    status_code: int = 200,
+    headers: Optional[dict] = None,
+) -> Response:
+    """
+    Builds a JSON response without re-validating or re-encoding the payload.
+
+    Serialization and compression run in a worker thread so large
+    FeatureCollections do not block the event loop.
+
+    Args:
+        content: Pre-built response data, or bytes that are already JSON encoded.
+        request (Request): The incoming request, used for content negotiation.
+        status_code (int): HTTP status code.
+        headers (dict): Extra response headers.
+
+    Returns:
+        Response: The encoded response.
+    """
+    accept_encoding = request.headers.get("accept-encoding", "") if request else ""
+    body, encoding = await asyncio.to_thread(encode_response_body, content, accept_encoding)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=body, status_code=status_code, headers=headers, media_type="application/json"
+    )
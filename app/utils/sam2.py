@@ -1,40 +1,144 @@
 import os
+import time
 from samgeo import SamGeo2, choose_device
+from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
 import torch
-from utils.utils import (
-    generate_geojson,
-    save_geojson,
-    get_timestamp,
-)
+import pandas as pd
+import geopandas as gpd
 from schemas.segment import SegmentRequestBase, SegmentResponseBase
 from utils.logger_config import log
-from utils.utils import base_files_names
-from utils.convert import read_simplify_and_filter_by_area
+from utils.utils import TempFiles, base_files_names
+from utils.convert import (
+    convex_hull_multipolygons,
+    mask_to_geodataframe,
+    masks_to_geodataframes,
+    read_simplify_and_filter_by_area,
+)
+from utils.persistence import write_behind
+from utils.embedding_store import set_image_cached
+from utils.spatial_store import store_results
+from utils.incremental import (
+    INCREMENTAL_AUTOMATIC,
+    footprint_feature,
+    merge_results,
+    plan_incremental,
+    settings_key,
+    write_window,
+)
+from utils.model_registry import (
+    DEFAULT_AUTOMATIC_MODEL,
+    DEFAULT_PREDICTOR_MODEL,
+    ModelRegistry,
+)
+from utils.stub_model import SAMGEO_STUB_MODEL, StubMaskGenerator, StubSamGeo2
+from utils.automatic_profiles import (
+    AUTOMATIC_PROFILES,
+    DEFAULT_QUALITY,
+    cost_model,
+    device_type,
+    image_megapixels,
+)
+
+# Load the default models at startup instead of on their first request
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "true").lower() == "true"
 
 # Initialize the SAM model
 device = choose_device()
-log.info(f"Using device: {device}")
-sam2 = SamGeo2(
-    model_id="sam2-hiera-large",
-    device=device,
-    apply_postprocessing=False,
-    points_per_side=32,
-    points_per_batch=64,
+log.info("Using device: %s", device)
+
+# Generator settings shared by every automatic quality tier
+AUTOMATIC_BASE_KWARGS = dict(
     pred_iou_thresh=0.7,
     stability_score_thresh=0.92,
     stability_score_offset=0.7,
-    crop_n_layers=1,
     box_nms_thresh=0.7,
     crop_n_points_downscale_factor=2,
     min_mask_region_area=25.0,
-    use_m2m=True,
 )
 
-sam2Predictor = SamGeo2(
-    model_id="sam2-hiera-large",
-    device=device,
-    automatic=False,
-)
+
+def load_sam2_model(model_id, automatic):
+    """
+    Builds a SamGeo2 instance for the model registry.
+
+    Args:
+        model_id (str): SAM2 model ID, e.g. "sam2-hiera-small".
+        automatic (bool): Whether to build the automatic mask generator or the predictor.
+
+    Returns:
+        SamGeo2: The loaded model.
+    """
+    if SAMGEO_STUB_MODEL:
+        return StubSamGeo2(model_id, automatic)
+    if automatic:
+        return SamGeo2(
+            model_id=model_id,
+            device=device,
+            apply_postprocessing=False,
+            **AUTOMATIC_BASE_KWARGS,
+            **AUTOMATIC_PROFILES[DEFAULT_QUALITY],
+        )
+    return SamGeo2(
+        model_id=model_id,
+        device=device,
+        automatic=False,
+    )
+
+
+models = ModelRegistry(loader=load_sam2_model)
+
+
+def preload_default_models():
+    """
+    Loads the default automatic and predictor models, so the first requests after
+    a deploy do not pay for the load and skew the measured service times.
+    """
+    if PRELOAD_MODELS:
+        models.preload([(DEFAULT_AUTOMATIC_MODEL, True), (DEFAULT_PREDICTOR_MODEL, False)])
+
+
+def get_mask_generator(entry, quality, points_per_side=None):
+    """
+    Returns the automatic mask generator for a quality tier, building it on first use.
+    All tiers share the model already loaded for `entry`. Must be called inside
+    `models.use`, which holds the entry's lock.
+
+    Args:
+        points_per_side (int): Optional override of the tier's point grid, e.g. to
+            keep the point density of a whole AOI on a window of it.
+    """
+    generators = entry.extras.setdefault("mask_generators", {})
+    if not generators:
+        generators[DEFAULT_QUALITY] = entry.model.mask_generator
+    key = quality if points_per_side is None else f"{quality}@{points_per_side}"
+    if key not in generators:
+        log.info("Building automatic mask generator '%s' for %s", key, entry.model_id)
+        settings = dict(AUTOMATIC_PROFILES[quality])
+        if points_per_side is not None:
+            settings["points_per_side"] = points_per_side
+        generator_class = StubMaskGenerator if SAMGEO_STUB_MODEL else SAM2AutomaticMaskGenerator
+        generators[key] = generator_class(
+            generators[DEFAULT_QUALITY].predictor.model,
+            **AUTOMATIC_BASE_KWARGS,
+            **settings,
+        )
+    return generators[key]
+
+
+def window_points_per_side(quality, window, pixels):
+    """Scales a tier's point grid to a window, keeping its density per pixel."""
+    points = AUTOMATIC_PROFILES[quality]["points_per_side"]
+    points *= ((window.width * window.height) / pixels) ** 0.5
+    # Rounded to a multiple of 4 to bound the number of cached generators
+    return max(8, int(round(points / 4)) * 4)
+
+
+def save_gpkg(gdf, gpkg_file_path):
+    """
+    Queues the vectorized masks as a GeoPackage artifact. Nothing reads it back,
+    so it is written off the response path from a copy of the GeoDataFrame.
+    """
+    write_behind.submit(gdf.copy().to_file, gpkg_file_path, driver="GPKG")
 
 
 def detect_automatic_sam2(request):
@@ -49,40 +153,141 @@ def detect_automatic_sam2(request):
     return_format = request.return_format
     simplify_tolerance= request.simplify_tolerance
     area_val = request.area_val
+    cleanup = request.mask_cleanup.model_dump() if request.mask_cleanup else None
 
     (
         _,
         _,
         tif_file_path,
-        mask_file_path,
+        _,
         geojson_file_path,
         gpkg_file_path,
         _,
         _,
         geojson_file_url,
     ) = base_files_names(project, id)
+    temp_files = TempFiles()
 
     try:
+        log.info("Processing detection for bbox: %s, zoom: %s, id: %s, project: %s", bbox, zoom, id, project)
+
+        # Pick generator settings that fit the latency budget or quality tier
+        megapixels = image_megapixels(tif_file_path)
+        device_kind = device_type(device)
+        model_id = request.model_id or DEFAULT_AUTOMATIC_MODEL
+        profile = cost_model.choose(
+            megapixels, device_kind, request.latency_budget, request.quality, model_id
+        )
+        quality = profile["quality"]
         log.info(
-            f"Processing detection for bbox: {bbox}, zoom: {zoom}, id: {id}, project: {project}"
+            "Automatic quality '%s' for %.2f MP, predicted %ss", quality, megapixels, profile["predicted_s"]
         )
 
-        # Run SAM2 model and convert raster to vector
-        sam2.generate(tif_file_path, output=mask_file_path)
-        sam2.raster_to_vector(mask_file_path, gpkg_file_path)
+        # Reuse earlier results of overlapping AOIs and only segment what is new
+        settings = settings_key(model_id, quality, cleanup, simplify_tolerance, area_val)
+        incremental = INCREMENTAL_AUTOMATIC if request.incremental is None else request.incremental
+        plan = plan_incremental(project, zoom, tif_file_path, settings) if incremental else None
+
+        # Run SAM2 model and convert raster to vector; a fully covered AOI needs no model
+        window_masks = []
+        generate_time = 0.0
+        if plan is None or plan.windows:
+            with models.use(model_id, automatic=True) as entry:
+                sam2 = entry.model
+                generate_start = time.monotonic()
+                if plan is None:
+                    mask_file_path = temp_files.new(f"mask_{id}_")
+                    sam2.mask_generator = get_mask_generator(entry, quality)
+                    sam2.generate(tif_file_path, output=mask_file_path)
+                else:
+                    for index, (window, _) in enumerate(plan.windows):
+                        window_file_path = temp_files.new(f"window_{id}_{index}_")
+                        window_masks.append(temp_files.new(f"mask_{id}_window_{index}_"))
+                        write_window(tif_file_path, window, window_file_path)
+                        points_per_side = window_points_per_side(quality, window, plan.pixels)
+                        sam2.mask_generator = get_mask_generator(entry, quality, points_per_side)
+                        sam2.generate(window_file_path, output=window_masks[-1])
+                generate_time = time.monotonic() - generate_start
+
+        if plan is None:
+            cost_model.record(quality, megapixels, device_kind, generate_time, model_id)
+            gdf = mask_to_geodataframe(mask_file_path, cleanup)
+        else:
+            window_gdfs = [mask_to_geodataframe(path, cleanup) for path in window_masks]
+            gdf = merge_results(plan, window_gdfs)
+        save_gpkg(gdf, gpkg_file_path)
+
+        # Reused features were simplified and filtered with the same settings when stored
+        geojson_data = read_simplify_and_filter_by_area(
+            None,
+            None,
+            simplify_tolerance,
+            area_val,
+            geojson_file_path,
+            gdf=gdf,
+            filter_rows=~gdf["reused"].astype(bool) if plan is not None else None,
+        )
+        # Reused features are already in the store; the footprint marks this AOI as segmented
+        new_features = [
+            feature
+            for feature in geojson_data["features"]
+            if not feature["properties"].get("reused")
+        ]
+        store_results(
+            project,
+            id,
+            "automatic",
+            zoom,
+            {"features": new_features},
+            geojson_file_path,
+            footprint=footprint_feature(tif_file_path, settings),
+        )
 
-        # geojson_data = generate_geojson(gpkg_file_path, geojson_file_path)
-        geojson_data = read_simplify_and_filter_by_area(gpkg_file_path, None, simplify_tolerance, area_val, geojson_file_path )
+        metadata = {
+            "automatic": {
+                "model_id": model_id,
+                "quality": quality,
+                "settings": AUTOMATIC_PROFILES[quality],
+                "device": device_kind,
+                "megapixels": round(megapixels, 3),
+                "latency_budget_s": request.latency_budget,
+                "calibrated": profile["calibrated"],
+                "budget_ignored": profile["budget_ignored"],
+                "predicted_s": round(profile["predicted_s"], 3) if profile["predicted_s"] else None,
+                "actual_s": round(generate_time, 3),
+            },
+            "incremental": None,
+        }
+        if plan is not None:
+            saved = profile["predicted_s"] - generate_time if profile["predicted_s"] else None
+            metadata["incremental"] = {
+                "reuse_ratio": round(plan.reuse_ratio, 3),
+                "processed_ratio": round(plan.processed_ratio, 3),
+                "windows": len(plan.windows),
+                "reused_features": len(geojson_data["features"]) - len(new_features),
+                "new_features": len(new_features),
+                "saved_s": round(saved, 3) if saved is not None else None,
+            }
+            log.info(
+                "Incremental automatic run for %s/%s: reused %.0f%% of the AOI, %d windows, saved %ss",
+                project,
+                id,
+                plan.reuse_ratio * 100,
+                len(plan.windows),
+                metadata["incremental"]["saved_s"],
+            )
 
         # Return response based on the requested format
         if return_format == "geojson":
-            return SegmentResponseBase(**geojson_data)
+            return {**geojson_data, "metadata": metadata}
         elif return_format == "url":
-            return {"geojson_url": geojson_file_url}
+            return {"geojson_url": geojson_file_url, "metadata": metadata}
 
     except Exception as e:
-        log.error(f"An error occurred during processing: {e}")
+        log.error("An error occurred during processing: %s", e)
         return {"error": str(e)}
+    finally:
+        temp_files.cleanup()
 
 
 def detect_predictor_sam2(request: SegmentRequestBase) -> SegmentResponseBase:
@@ -100,77 +305,88 @@ def detect_predictor_sam2(request: SegmentRequestBase) -> SegmentResponseBase:
     return_format = request.return_format
     simplify_tolerance= request.simplify_tolerance
     area_val = request.area_val
+    cleanup = request.mask_cleanup.model_dump() if request.mask_cleanup else None
 
     (
         _,
         _,
         tif_file_path,
-        mask_file_path,
+        _,
         geojson_file_path,
         gpkg_file_path,
         _,
         _,
         geojson_file_url,
     ) = base_files_names(project, id)
-
-    geojson_data = {}
+    temp_files = TempFiles()
 
     try:
-        sam2Predictor.set_image(tif_file_path)
-
-        # Process single point
-        if action_type == "single_point":
-            log.info(
-                f"Predicting single point for id: {id}, project: {project}, bbox: {bbox}, zoom: {zoom}"
+        model_id = request.model_id or DEFAULT_PREDICTOR_MODEL
+        with models.use(model_id, automatic=False) as entry:
+            sam2Predictor = entry.model
+            features_source, persist_features = set_image_cached(
+                sam2Predictor, tif_file_path, model_id, project, id
             )
-            sam2Predictor.predict(
-                point_coords,
-                point_labels=point_labels,
-                point_crs="EPSG:4326",
-                output=mask_file_path,
-            )
-            # Convert raster to vector and generate GeoJSON
-            sam2.raster_to_vector(mask_file_path, gpkg_file_path)
-            geojson_data = generate_geojson(gpkg_file_path, geojson_file_path)
-
-        # Process multiple points
-        elif action_type == "multi_point":
-            geojson_array = []
-            for index, p_coords in enumerate(point_coords):
+            log.info("Image features for %s/%s: %s", project, id, features_source)
+
+            # Process single point
+            if action_type == "single_point":
                 log.info(
-                    f"Processing multi-point {p_coords} for id: {id}, project: {project}, point index: {index}"
+                    "Predicting single point for id: %s, project: %s, bbox: %s, zoom: %s", id, project, bbox, zoom
                 )
-
-                # Temporary file paths for each point
-                mask_file_path_tmp = f"tmp/mask_{id}_{index}.tif"
-                gpkg_file_path_tmp = f"tmp/{id}_{index}.gpkg"
-                geojson_file_path_tmp = f"tmp/{id}_{index}.geojson"
-
+                mask_file_path = temp_files.new(f"mask_{id}_")
                 sam2Predictor.predict(
-                    [p_coords], point_labels=1, point_crs="EPSG:4326", output=mask_file_path_tmp
+                    point_coords,
+                    point_labels=point_labels,
+                    point_crs="EPSG:4326",
+                    output=mask_file_path,
                 )
+                # Convert raster to vector
+                gdf = convex_hull_multipolygons(mask_to_geodataframe(mask_file_path, cleanup))
+
+            # Process multiple points
+            elif action_type == "multi_point":
+                mask_file_paths = []
+                for index, p_coords in enumerate(point_coords):
+                    log.debug(
+                        "Processing multi-point %s for id: %s, project: %s, point index: %d",
+                        p_coords,
+                        id,
+                        project,
+                        index,
+                    )
 
-                # Convert raster to vector and generate GeoJSON
-                sam2.raster_to_vector(mask_file_path_tmp, gpkg_file_path_tmp)
-                geojson_ = generate_geojson(gpkg_file_path_tmp, geojson_file_path_tmp)
+                    # Temporary mask path for each point
+                    mask_file_path_tmp = temp_files.new(f"mask_{id}_{index}_")
 
-                for feat in geojson_["features"]:
-                    geojson_array.append(feat)
+                    sam2Predictor.predict(
+                        [p_coords], point_labels=1, point_crs="EPSG:4326", output=mask_file_path_tmp
+                    )
 
-            geojson_data["features"] = geojson_array
-            save_geojson(geojson_data, geojson_file_path)
+                    mask_file_paths.append(mask_file_path_tmp)
 
+                # Convert raster to vector, cleaning the masks of all points in one batch
+                gdfs = [
+                    convex_hull_multipolygons(mask_gdf)
+                    for mask_gdf in masks_to_geodataframes(mask_file_paths, cleanup)
+                ]
+                gdf = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=gdfs[0].crs)
 
-        geojson_data = read_simplify_and_filter_by_area(None, geojson_data, simplify_tolerance, area_val, geojson_file_path )
+        # Queued once the model lock is released, so backpressure only slows this request
+        if persist_features is not None:
+            persist_features()
+        save_gpkg(gdf, gpkg_file_path)
+        geojson_data = read_simplify_and_filter_by_area(None, None, simplify_tolerance, area_val, geojson_file_path, gdf=gdf)
+        store_results(project, id, "predictor", zoom, geojson_data, geojson_file_path)
 
         # Return response based on the requested format
         if return_format == "geojson":
-            return SegmentResponseBase(**geojson_data)
+            return geojson_data
         elif return_format == "url":
             return {"geojson_url": geojson_file_url}
 
     except Exception as e:
-        log.error(
-            f"An error occurred during point-based segmentation for id: {id}, project: {project}: {e}"
-        )
+        log.error("An error occurred during point-based segmentation for id: %s, project: %s: %s", id, project, e)
         return {"error": str(e)}
+    finally:
+        temp_files.cleanup()
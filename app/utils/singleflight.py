@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+from utils.logger_config import log
+
+
+def request_key(kind: str, request, aoi_fingerprint: str) -> str:
+    """
+    Builds a canonical hash for a segmentation request.
+
+    Args:
+        kind (str): Segmentation mode, e.g. "automatic" or "predictor".
+        request (SegmentRequestBase): The incoming request.
+        aoi_fingerprint (str): Fingerprint of the AOI raster the request runs on.
+
+    Returns:
+        str: A hex digest identifying identical requests.
+    """
+    payload = {
+        "kind": kind,
+        "aoi": aoi_fingerprint,
+        "request": request.model_dump(mode="json"),
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing the same key into one computation.
+
+    The first caller for a key (the leader) runs the work; callers arriving
+    while it is still in flight await the same result instead of running it again.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"leaders": 0, "deduplicated": 0, "errors": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `fn` once for all concurrent callers using `key`.
+
+        Args:
+            key (str): Canonical request key.
+            fn (Callable): Coroutine factory executed by the leader only.
+
+        Returns:
+            Any: The shared result of `fn`.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["deduplicated"] += 1
+            log.info("Joining in-flight request %s", key[:12])
+        else:
+            self.stats["leaders"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        # A cancelled caller (e.g. client disconnect) must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+
+    def metrics(self) -> dict:
+        """Returns dedup counters and the number of computations in flight."""
+        return {**self.stats, "inflight": len(self._inflight)}
+
+
+inflight = SingleFlight()
@@ -0,0 +1,308 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional
+import fiona
+import shapely
+from shapely.geometry import mapping
+from utils.logger_config import log
+from utils.persistence import retry, write_behind
+
+STORE_FILE_NAME = "_results.gpkg"
+# Features read per GeoPackage transaction when exporting a whole project
+EXPORT_PAGE_FEATURES = int(os.getenv("SPATIAL_STORE_EXPORT_PAGE", "5000"))
+
+# Every process opening the store (API, write-behind thread, inference workers) waits
+# for SQLite locks instead of failing. GDAL reads this when a GeoPackage is opened; for
+# other GeoPackages it only turns a lock error into a short wait.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+os.environ.setdefault("OGR_SQLITE_PRAGMA", f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+# WAL lets reads and appends run concurrently, but is unsafe on network file systems,
+# e.g. a volume shared by several pods. Only enable it when the store is on local disk.
+SPATIAL_STORE_WAL = os.getenv("SPATIAL_STORE_WAL", "false").lower() == "true"
+FEATURES_LAYER = "features"
+FOOTPRINTS_LAYER = "footprints"
+
+FEATURES_SCHEMA = {
+    "geometry": "Unknown",
+    "properties": {
+        "aoi_id": "str",
+        "source": "str",
+        "zoom": "int",
+        "created": "int",
+        "geojson_file": "str",
+        "value": "float",
+        "area_m2": "float",
+    },
+}
+
+# Raster extent processed by each automatic run, used to reuse results of overlapping AOIs
+FOOTPRINTS_SCHEMA = {
+    "geometry": "Polygon",
+    "properties": {
+        "aoi_id": "str",
+        "zoom": "int",
+        "settings": "str",
+        "created": "int",
+        "geojson_file": "str",
+    },
+}
+
+
+class SpatialStore:
+    """
+    Per-project GeoPackage holding every segmentation result of the project.
+
+    Results are appended as they are produced, and the GeoPackage R-tree index
+    lets bbox queries read only the intersecting features instead of every
+    `.geojson` file listed by `/predictions`. Appends go through fiona; reads use
+    SQLite directly, so pages are read in feature id order and resume after the
+    last id of the previous page instead of skipping an offset.
+    """
+
+    def __init__(self, root: str = "public"):
+        self.root = root
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._wal_projects = set()
+
+    def path(self, project: str) -> str:
+        return os.path.join(self.root, project, STORE_FILE_NAME)
+
+    def _lock(self, project: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(project, threading.Lock())
+
+    def append(
+        self,
+        project: str,
+        features: List[dict],
+        properties: dict,
+        layer: str = FEATURES_LAYER,
+        schema: dict = FEATURES_SCHEMA,
+    ):
+        """
+        Appends GeoJSON features to the project store.
+
+        Args:
+            project (str): Project ID.
+            features (list): GeoJSON features in EPSG:4326.
+            properties (dict): Properties shared by all features, e.g. the AOI ID and source.
+            layer (str): GeoPackage layer to append to.
+            schema (dict): Fiona schema used when the layer is created.
+        """
+        if not features:
+            return
+        columns = schema["properties"]
+        records = []
+        for feature in features:
+            feature_properties = {**(feature.get("properties") or {}), **properties}
+            records.append(
+                {
+                    "geometry": feature["geometry"],
+                    "properties": {key: feature_properties.get(key) for key in columns},
+                }
+            )
+
+        path = self.path(project)
+        with self._lock(project):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            exists = os.path.exists(path) and layer in fiona.listlayers(path)
+            with fiona.open(
+                path,
+                "a" if exists else "w",
+                driver="GPKG",
+                layer=layer,
+                schema=None if exists else schema,
+                crs=None if exists else "EPSG:4326",
+            ) as dst:
+                dst.writerecords(records)
+            if SPATIAL_STORE_WAL and project not in self._wal_projects:
+                # The journal mode is stored in the file, so it only applies to this store
+                connection = self._connect(path)
+                try:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                finally:
+                    connection.close()
+                self._wal_projects.add(project)
+        log.info("Appended %d features to %s (%s)", len(records), path, layer)
+
+    def _connect(self, path: str, read_only: bool = False) -> sqlite3.Connection:
+        uri = f"file:{path}?mode=ro" if read_only else f"file:{path}"
+        return sqlite3.connect(uri, uri=True, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+
+    def query(
+        self,
+        project: str,
+        bbox: Optional[tuple] = None,
+        after: int = 0,
+        limit: Optional[int] = None,
+        layer: str = FEATURES_LAYER,
+    ) -> List[dict]:
+        """
+        Returns the stored features intersecting a bbox, in insertion order.
+
+        Features are matched on their R-tree bounding box, like an OGR spatial
+        filter. The page is read into memory and the GeoPackage closed before
+        returning, so a slow client streaming the result never holds the file open.
+
+        Args:
+            project (str): Project ID.
+            bbox (tuple): (min_lon, min_lat, max_lon, max_lat), or None for all features.
+            after (int): Only features with a greater id are returned; pass the id
+                of the last feature of the previous page.
+            limit (int): Maximum number of features to return, or None for all.
+
+        Returns:
+            list: GeoJSON features, with their id.
+        """
+        path = self.path(project)
+        if not os.path.exists(path):
+            return []
+        connection = self._connect(path, read_only=True)
+        try:
+            row = connection.execute(
+                "SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?", (layer,)
+            ).fetchone()
+            if row is None:
+                return []
+            geometry_column = row[0]
+            sql = f'SELECT * FROM "{layer}" WHERE fid > ?'
+            params = [after]
+            if bbox:
+                sql += (
+                    f' AND fid IN (SELECT id FROM "rtree_{layer}_{geometry_column}"'
+                    " WHERE maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ?)"
+                )
+                params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+            sql += " ORDER BY fid"
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            cursor = connection.execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            features = []
+            for values in cursor:
+                properties = dict(zip(columns, values))
+                fid = properties.pop("fid")
+                geometry = _gpkg_geometry(properties.pop(geometry_column))
+                features.append(
+                    {"type": "Feature", "id": fid, "geometry": geometry, "properties": properties}
+                )
+            return features
+        finally:
+            connection.close()
+
+    def iter_features(
+        self, project: str, layer: str = FEATURES_LAYER, page_size: int = EXPORT_PAGE_FEATURES
+    ) -> Iterator[dict]:
+        """
+        Yields every stored feature, one page per GeoPackage read.
+
+        Each page resumes after the last id of the previous one, so a full export
+        reads every feature once, and the store is closed between pages.
+        """
+        after = 0
+        while True:
+            page = self.query(project, after=after, limit=page_size, layer=layer)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]["id"]
+
+    def snapshot(self, project: str, output: str):
+        """
+        Copies the project store to `output` with the SQLite backup API, which gives
+        a consistent copy while appends keep running.
+        """
+        source = self._connect(self.path(project), read_only=True)
+        try:
+            target = sqlite3.connect(output)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+
+spatial_store = SpatialStore()
+
+
+def _gpkg_geometry(blob: Optional[bytes]) -> Optional[dict]:
+    """Decodes a GeoPackage geometry blob (header, optional envelope, WKB) to GeoJSON."""
+    if blob is None:
+        return None
+    flags = blob[3]
+    envelope_bytes = (0, 32, 48, 48, 64)[(flags >> 1) & 0b111]
+    return mapping(shapely.from_wkb(bytes(blob[8 + envelope_bytes :])))
+
+
+def _append_batch(calls: List[tuple]):
+    """
+    Writes the appends queued for one project.
+
+    Features and footprints are separate layers, each written in its own
+    transaction. Footprints go last, so a footprint is never visible without
+    its features. Each layer is retried on its own, so a failed footprint write
+    is retried without appending the features twice. A footprint that still
+    cannot be written only means the area is segmented again by the next
+    overlapping run; reused features that overlap are deduplicated there.
+    """
+    project = calls[0][0][0]
+    features = [feature for (_, batch_features), _ in calls for feature in batch_features]
+    footprints = [kwargs["footprint"] for _, kwargs in calls if kwargs.get("footprint")]
+    retry(spatial_store.append, project, features, {})
+    retry(
+        spatial_store.append,
+        project,
+        footprints,
+        {},
+        layer=FOOTPRINTS_LAYER,
+        schema=FOOTPRINTS_SCHEMA,
+    )
+
+
+def store_results(
+    project: str,
+    id: str,
+    source: str,
+    zoom: int,
+    geojson_data: dict,
+    geojson_file_path: str,
+    footprint: Optional[dict] = None,
+):
+    """
+    Queues a segmentation result for appending to the project store.
+
+    The append runs on the write-behind thread, merged with other results of the
+    same project, so it neither delays nor fails the request.
+
+    Args:
+        footprint (dict): Optional GeoJSON feature of the area processed by an
+            automatic run, stored in the footprints layer with its properties.
+    """
+    properties = {
+        "aoi_id": id,
+        "source": source,
+        "zoom": zoom,
+        "created": int(time.time()),
+        "geojson_file": os.path.basename(geojson_file_path),
+    }
+    features = [
+        {
+            "geometry": feature["geometry"],
+            "properties": {**(feature.get("properties") or {}), **properties},
+        }
+        for feature in geojson_data.get("features", [])
+    ]
+    if footprint is not None:
+        footprint = {
+            "geometry": footprint["geometry"],
+            "properties": {**properties, **footprint.get("properties", {})},
+        }
+    if features or footprint:
+        write_behind.submit(
+            _append_batch, project, features, group=project, footprint=footprint
+        )
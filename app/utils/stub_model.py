@@ -0,0 +1,157 @@
+import os
+import time
+import zlib
+import threading
+import contextlib
+import numpy as np
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform as warp_transform
+import torch
+from utils.logger_config import log
+from utils.automatic_profiles import AUTOMATIC_PROFILES, DEFAULT_QUALITY
+
+SAMGEO_STUB_MODEL = os.getenv("SAMGEO_STUB_MODEL", "false").lower() == "true"
+# Simulated run times, roughly those of sam2-hiera-large on a mid-range GPU
+STUB_ENCODER_S = float(os.getenv("STUB_ENCODER_S", "0.25"))
+STUB_DECODER_S = float(os.getenv("STUB_DECODER_S", "0.02"))
+STUB_AUTOMATIC_S_PER_MPX = float(os.getenv("STUB_AUTOMATIC_S_PER_MPX", "2.0"))
+
+
+def _write_mask(source: str, output: str, band: np.ndarray):
+    """Writes a single-band mask aligned with the source raster."""
+    with rasterio.open(source) as src:
+        profile = src.profile
+    profile.update(count=1, dtype=band.dtype.name, nodata=None)
+    with rasterio.open(output, "w", **profile) as dst:
+        dst.write(band, 1)
+
+
+def _disc(shape, row: int, col: int, radius: int) -> np.ndarray:
+    rows, cols = np.ogrid[: shape[0], : shape[1]]
+    return (rows - row) ** 2 + (cols - col) ** 2 <= radius**2
+
+
+class StubModule(torch.nn.Module):
+    """Stands in for the SAM2 network, with a parameter so memory accounting works."""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(256), requires_grad=False)
+
+
+class StubPredictor:
+    """The SAM2ImagePredictor attributes used by the embedding store."""
+
+    def __init__(self, model: StubModule):
+        self.model = model
+        self.device = torch.device("cpu")
+        self.reset_predictor()
+
+    def reset_predictor(self):
+        self._features = None
+        self._orig_hw = None
+        self._is_batch = False
+        self._is_image_set = False
+
+
+class StubMaskGenerator:
+    """Accepts the SAM2AutomaticMaskGenerator arguments; its cost follows the point grid."""
+
+    def __init__(self, model: StubModule, points_per_side: int = 32, crop_n_layers: int = 0, **kwargs):
+        self.predictor = StubPredictor(model)
+        self.points_per_side = points_per_side
+        self.crop_n_layers = crop_n_layers
+
+    def cost_s(self, megapixels: float) -> float:
+        # Relative to the "high" tier: 32 points per side and one crop layer
+        scale = (self.points_per_side / 32) ** 2 * (1 + self.crop_n_layers) / 2
+        return STUB_AUTOMATIC_S_PER_MPX * megapixels * scale
+
+
+class StubSamGeo2:
+    """
+    Drop-in replacement for SamGeo2 used when SAMGEO_STUB_MODEL=true.
+
+    It sleeps for the configured encoder, decoder and generator times and writes
+    plausible masks aligned with the AOI raster, so the whole request path (model
+    registry, embedding store, vectorization, persistence) runs without weights
+    or a GPU. Like SamGeo2 it keeps per-call state, and it fails every call that
+    overlaps another one on the same instance, which exposes missing locking
+    under load.
+    """
+
+    def __init__(self, model_id: str, automatic: bool):
+        self.model_id = model_id
+        module = StubModule()
+        if automatic:
+            self.mask_generator = StubMaskGenerator(module, **AUTOMATIC_PROFILES[DEFAULT_QUALITY])
+        else:
+            self.predictor = StubPredictor(module)
+        self.source = None
+        self.image = None
+        self._active = 0
+        self._overlapped = False
+        self._active_lock = threading.Lock()
+        log.info("Using stub model for %s (automatic=%s)", model_id, automatic)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        with self._active_lock:
+            if self._active:
+                self._overlapped = True
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._active_lock:
+                self._active -= 1
+                overlapped = self._overlapped
+                if self._active == 0:
+                    self._overlapped = False
+        if overlapped:
+            raise RuntimeError(f"Stub {self.model_id} instance used by concurrent requests")
+
+    def set_image(self, source: str):
+        with self._exclusive():
+            with rasterio.open(source) as src:
+                height, width = src.height, src.width
+            time.sleep(STUB_ENCODER_S)
+            # Same shapes as the sam2-hiera image features, to keep memory use realistic
+            self.predictor._features = {
+                "image_embed": torch.zeros(1, 256, 64, 64),
+                "high_res_feats": [torch.zeros(1, 32, 256, 256), torch.zeros(1, 64, 128, 128)],
+            }
+            self.predictor._orig_hw = [(height, width)]
+            self.predictor._is_image_set = True
+            self.source = source
+
+    def predict(self, point_coords, point_labels=None, point_crs=None, output=None, **kwargs):
+        with self._exclusive():
+            if not self.predictor._is_image_set:
+                raise RuntimeError("An image must be set with set_image before predict")
+            time.sleep(STUB_DECODER_S)
+            with rasterio.open(self.source) as src:
+                shape, transform, crs = (src.height, src.width), src.transform, src.crs
+            xs, ys = zip(*point_coords)
+            if point_crs is not None and crs is not None:
+                xs, ys = warp_transform(point_crs, crs, xs, ys)
+            band = np.zeros(shape, dtype=np.uint8)
+            radius = max(2, min(shape) // 20)
+            for row, col in zip(*rowcol(transform, xs, ys)):
+                band[_disc(shape, row, col, radius)] = 1
+            _write_mask(self.source, output, band)
+
+    def generate(self, source: str, output=None, **kwargs):
+        with self._exclusive():
+            with rasterio.open(source) as src:
+                shape = (src.height, src.width)
+            time.sleep(self.mask_generator.cost_s(shape[0] * shape[1] / 1e6))
+            rng = np.random.default_rng(zlib.crc32(source.encode("utf-8")))
+            n_masks = min(255, int(60 * (self.mask_generator.points_per_side / 32) ** 2))
+            band = np.zeros(shape, dtype=np.uint8)
+            for value in range(1, n_masks + 1):
+                radius = int(rng.integers(3, max(4, min(shape) // 25)))
+                row, col = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+                band[_disc(shape, row, col, radius)] = value
+            _write_mask(source, output, band)
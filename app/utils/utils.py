@@ -5,10 +5,13 @@ import logging
 import geopandas as gpd
 import json
 import psutil
+import tempfile
+import contextlib
 from datetime import datetime
 from samgeo import tms_to_geotiff, choose_device
 from shapely.geometry import Polygon, MultiPolygon
 from utils.logger_config import log
+from utils.responses import json_default
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 
@@ -127,10 +130,10 @@ def save_geojson(json_data, output_geojson_path):
     """
     try:
         with open(output_geojson_path, "w", encoding="utf-8") as geojson_file:
-            json.dump(json_data, geojson_file, ensure_ascii=False, indent=4)
-        log.info(f"GeoJSON data successfully saved to {output_geojson_path}")
+            json.dump(json_data, geojson_file, ensure_ascii=False, indent=4, default=json_default)
+        log.info("GeoJSON data successfully saved to %s", output_geojson_path)
     except Exception as e:
-        log.error(f"Failed to save GeoJSON data: {e}")
+        log.error("Failed to save GeoJSON data: %s", e)
         raise e
 
 
@@ -149,7 +152,7 @@ def generate_geojson(gpkg_file_path, output_geojson_path):
         Exception: If an error occurs during GeoJSON generation.
     """
     try:
-        log.info(f"Converting segmentation results to GeoJSON at {output_geojson_path}")
+        log.info("Converting segmentation results to GeoJSON at %s", output_geojson_path)
         gdf = gpd.read_file(gpkg_file_path)
         gdf_wgs84 = gdf.to_crs(epsg=4326)
         gdf_wgs84["geometry"] = gdf_wgs84["geometry"].apply(
@@ -160,11 +163,11 @@ def generate_geojson(gpkg_file_path, output_geojson_path):
             )
         )
         gdf_wgs84.to_file(output_geojson_path, driver="GeoJSON")
-        geojson_data = json.loads(gdf_wgs84.to_json())
+        geojson_data = gdf_wgs84.to_geo_dict()
         return geojson_data
 
     except Exception as e:
-        log.error(f"Error generating GeoJSON: {e}")
+        log.error("Error generating GeoJSON: %s", e)
         return None
 
 
@@ -185,9 +188,9 @@ def download_tif_if_not_exists(bbox, zoom, project, id, output_dir="public"):
     output_image_name = f"{project}/{id}_a.tif"
     output_image_path = os.path.join(output_dir, output_image_name)
     if os.path.exists(output_image_path):
-        log.info(f"Satellite image already exists at: {output_image_path}. Skipping download.")
+        log.info("Satellite image already exists at: %s. Skipping download.", output_image_path)
     else:
-        log.info(f"Downloading satellite imagery for bbox: {bbox} at zoom level: {zoom}")
+        log.info("Downloading satellite imagery for bbox: %s at zoom level: %s", bbox, zoom)
         tms_to_geotiff(
             output=output_image_path, bbox=bbox, zoom=int(zoom), source="Satellite", overwrite=True
         )
@@ -261,3 +264,54 @@ def base_files_names(project, id):
         tif_file_url,
         geojson_file_url,
     )
+
+
+def aoi_fingerprint(project, id):
+    """
+    Returns a cheap fingerprint of the AOI raster for the project and ID.
+
+    The fingerprint changes whenever `/aoi` rewrites the GeoTIFF, so requests
+    made against different captures of the same ID never share results.
+
+    Returns:
+        str: "<size>-<mtime_ns>" of the GeoTIFF, or "missing" if it does not exist.
+    """
+    tif_file_path = os.path.join(f"public/{project}", f"{id}.tif")
+    try:
+        stat = os.stat(tif_file_path)
+    except FileNotFoundError:
+        return "missing"
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class TempFiles:
+    """
+    Uniquely named intermediate files of one request (e.g. masks written by the
+    model), created in `tmp` and removed by `cleanup`. Concurrent requests on the
+    same AOI, or with different models, never share a path.
+    """
+
+    def __init__(self, suffix: str = ".tif", directory: str = "tmp"):
+        self.suffix = suffix
+        self.directory = directory
+        self.paths = []
+
+    def new(self, prefix: str = "") -> str:
+        """Returns the path of a new empty file."""
+        os.makedirs(self.directory, exist_ok=True)
+        handle, path = tempfile.mkstemp(prefix=prefix, suffix=self.suffix, dir=self.directory)
+        os.close(handle)
+        self.paths.append(path)
+        return path
+
+    def cleanup(self):
+        for path in self.paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
@@ -0,0 +1,301 @@
+import os
+import json
+import zlib
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+from utils.logger_config import log, request_id
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "600"))
+
+
+def partition_cores(n_workers: int, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Splits the available CPU cores into contiguous, non-overlapping slices.
+
+    Args:
+        n_workers (int): Number of worker processes.
+        cores (list): Cores to split, defaults to the cores this process may run on.
+
+    Returns:
+        list: One list of core ids per worker.
+    """
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    n_workers = max(1, min(n_workers, len(cores)))
+    size, extra = divmod(len(cores), n_workers)
+    slices, start = [], 0
+    for index in range(n_workers):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def _worker_main(index: int, cores: List[int], requests, results, n_workers: int = 1):
+    """Entry point of an inference process: pin, load lazily and serve requests."""
+    # Thread pools must be sized before torch is imported in this fresh interpreter
+    threads = str(len(cores))
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["MKL_NUM_THREADS"] = threads
+    os.sched_setaffinity(0, cores)
+
+    import torch
+
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    from schemas.segment import SegmentRequestBase
+    from utils.sam2 import (
+        detect_automatic_sam2,
+        detect_predictor_sam2,
+        models,
+        preload_default_models,
+    )
+    from utils.persistence import write_behind
+    from utils.profiling import ProfileSession
+    from utils.responses import dumps
+
+    # Workers share the device, so MODEL_MEMORY_BUDGET_MB is split between them
+    models.budget_bytes //= n_workers
+    preload_default_models()
+    detectors = {"automatic": detect_automatic_sam2, "predictor": detect_predictor_sam2}
+    log.info("Inference worker %d ready on cores %s with %s torch threads", index, cores, threads)
+
+    while True:
+        job = requests.get()
+        if job is None:
+            write_behind.flush()
+            break
+        job_id, kind, payload, profile_label, rid = job
+        request_id.set(rid)
+        profile_urls = []
+        try:
+            request = SegmentRequestBase(**payload)
+            fn = detectors[kind]
+            if profile_label:
+                session = ProfileSession(profile_label)
+                fn = session.wrap(fn)
+                profile_urls = session.urls
+            result = fn(request=request)
+            if request.return_format == "url":
+                # The parent cannot serve this process's pending files from memory
+                write_behind.flush()
+        except Exception as e:
+            result = {"error": str(e)}
+        is_error = isinstance(result, dict) and "error" in result
+
+        # Hand the encoded result over through shared memory instead of pickling it
+        body = dumps(result)
+        shm = shared_memory.SharedMemory(create=True, size=max(len(body), 1))
+        shm.buf[: len(body)] = body
+        results.put((job_id, shm.name, len(body), is_error, profile_urls))
+        shm.close()
+
+
+class _Job:
+    __slots__ = ("worker", "event", "result", "session")
+
+    def __init__(self, worker: int, session):
+        self.worker = worker
+        self.event = threading.Event()
+        self.result = None
+        self.session = session
+
+
+class InferencePool:
+    """
+    Runs segmentation in N processes, each pinned to its own slice of CPU cores.
+
+    Requests for the same AOI (project/id) always go to the same worker, so its
+    predictor keeps the image features warm. Results come back as encoded JSON
+    bytes in shared memory and can be sent to the client as they are. A worker
+    that crashes, or whose request times out, is replaced by a fresh process
+    with a fresh request queue.
+    """
+
+    def __init__(self, n_workers: int):
+        self._ctx = mp.get_context("spawn")
+        self.cores = partition_cores(n_workers)
+        self.n_workers = len(self.cores)
+        self._results = self._ctx.Queue()
+        self._requests = [self._ctx.Queue() for _ in range(self.n_workers)]
+        self._processes: List[Optional[mp.Process]] = [None] * self.n_workers
+        self._jobs: Dict[int, _Job] = {}
+        self._jobs_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._collector: Optional[threading.Thread] = None
+        self._monitor: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {"submitted": [0] * self.n_workers, "restarts": 0, "timeouts": 0}
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.cores[index], self._requests[index], self._results, self.n_workers),
+            name=f"inference-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.n_workers):
+            self._spawn(index)
+        self._collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._watch, name="inference-monitor", daemon=True)
+        self._monitor.start()
+        log.info("Started %d inference workers on cores %s", self.n_workers, self.cores)
+
+    def _fail_jobs(self, worker: int, message: str):
+        with self._jobs_lock:
+            failed = [job for job in self._jobs.values() if job.worker == worker]
+        for job in failed:
+            job.result = {"error": message}
+            job.event.set()
+
+    def _watch(self):
+        """
+        Restarts crashed workers and fails the requests they were holding as soon
+        as a process exits, independently of the results other workers return.
+        """
+        while not self._stopping:
+            sentinels = {
+                process.sentinel: index
+                for index, process in enumerate(self._processes)
+                if process is not None
+            }
+            for sentinel in wait(list(sentinels), timeout=1):
+                index = sentinels[sentinel]
+                process = self._processes[index]
+                if self._stopping:
+                    return
+                # Reap it, so the exit code is known
+                process.join(1)
+                log.error("Inference worker %d exited with %s", index, process.exitcode)
+                # Replaced before failing the jobs, so no job is sent to the old queue unnoticed
+                self._replace_requests(index)
+                self._fail_jobs(index, f"Inference worker {index} stopped before finishing")
+                self.stats["restarts"] += 1
+                self._spawn(index)
+
+    def _replace_requests(self, index: int):
+        """
+        Gives a worker slot a new request queue. A worker killed while waiting for
+        a job dies holding the old queue's reader lock, which would deadlock its
+        replacement. The jobs left in the old queue are failed by the caller and
+        never run.
+        """
+        old = self._requests[index]
+        self._requests[index] = self._ctx.Queue()
+        old.close()
+        old.cancel_join_thread()
+
+    def _recycle(self, index: int):
+        """Kills a worker still busy with a timed out request; `_watch` replaces it."""
+        process = self._processes[index]
+        if process is not None and process.is_alive():
+            log.error("Killing inference worker %d, a request timed out", index)
+            process.kill()
+            process.join(5)
+
+    def _collect(self):
+        while not self._stopping:
+            try:
+                job_id, shm_name, size, is_error, profile_urls = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                body = bytes(shm.buf[:size])
+            finally:
+                shm.close()
+                shm.unlink()
+
+            with self._jobs_lock:
+                job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            job.result = json.loads(body) if is_error else body
+            if job.session is not None:
+                job.session.urls.extend(profile_urls)
+            job.event.set()
+
+    def route(self, project: str, id: str) -> int:
+        """Returns the worker index owning an AOI; stable across restarts."""
+        return zlib.crc32(f"{project}/{id}".encode("utf-8")) % self.n_workers
+
+    def run(self, kind: str, request, session=None):
+        """
+        Runs a segmentation request on the worker owning its AOI and waits for it.
+
+        Args:
+            kind (str): "automatic" or "predictor".
+            request (SegmentRequestBase): The request to run.
+            session (ProfileSession): Optional profiling session; the worker profiles
+                the request and its trace URLs are added to the session.
+
+        Returns:
+            bytes | dict: The encoded JSON result, or an {"error": ...} dict.
+        """
+        worker = self.route(request.project, request.id)
+        job_id = next(self._ids)
+        job = _Job(worker, session)
+        with self._jobs_lock:
+            self._jobs[job_id] = job
+        self.stats["submitted"][worker] += 1
+        try:
+            try:
+                self._requests[worker].put(
+                    (
+                        job_id,
+                        kind,
+                        request.model_dump(mode="json"),
+                        session.label if session else None,
+                        request_id.get(),
+                    )
+                )
+            except ValueError:
+                # The worker exited and its queue was closed; `_watch` fails this job
+                pass
+            if not job.event.wait(INFERENCE_TIMEOUT_S):
+                self.stats["timeouts"] += 1
+                # The caller's admission slot is released on return, so the device
+                # must really be free by then
+                self._recycle(worker)
+                return {"error": f"Inference timed out after {INFERENCE_TIMEOUT_S:.0f}s"}
+            return job.result
+        finally:
+            with self._jobs_lock:
+                self._jobs.pop(job_id, None)
+
+    def stop(self, timeout: float = 30):
+        """Asks every worker to flush its pending writes and exit."""
+        self._stopping = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+    def metrics(self) -> dict:
+        with self._jobs_lock:
+            inflight = len(self._jobs)
+        return {
+            "workers": self.n_workers,
+            "cores": self.cores,
+            "alive": [bool(p and p.is_alive()) for p in self._processes],
+            "inflight": inflight,
+            **self.stats,
+        }
+
+
+inference_pool = InferencePool(INFERENCE_WORKERS) if INFERENCE_WORKERS > 0 else None